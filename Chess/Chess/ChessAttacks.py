@@ -0,0 +1,92 @@
+"""
+attack tables, built once at import: knight, king and pawn attacks per square, the ray from every square in every
+direction, and the squares between any two aligned squares. square index is row * 8 + col
+"""
+
+# 4 orthogonal then 4 diagonal. directions 2, 3, 6 and 7 increase the square index, so the nearest blocker on those
+# rays is the lowest set bit, on the others it is the highest
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+
+KNIGHT_STEPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_STEPS = DIRECTIONS
+
+
+def _stepAttacks(sq, steps):
+   r, c = sq >> 3, sq & 7
+   attacks = 0
+   for dr, dc in steps:
+      if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+         attacks |= 1 << ((r + dr) * 8 + c + dc)
+   return attacks
+
+
+def _ray(sq, d):
+   r, c = (sq >> 3) + d[0], (sq & 7) + d[1]
+   ray = 0
+   while 0 <= r < 8 and 0 <= c < 8:
+      ray |= 1 << (r * 8 + c)
+      r, c = r + d[0], c + d[1]
+   return ray
+
+
+KNIGHT_ATTACKS = [_stepAttacks(sq, KNIGHT_STEPS) for sq in range(64)]
+KING_ATTACKS = [_stepAttacks(sq, KING_STEPS) for sq in range(64)]
+# PAWN_ATTACKS[color][sq]: squares a pawn of that colour on sq attacks, white towards row 0
+PAWN_ATTACKS = [[_stepAttacks(sq, ((-1, -1), (-1, 1))) for sq in range(64)],
+                [_stepAttacks(sq, ((1, -1), (1, 1))) for sq in range(64)]]
+RAYS = [[_ray(sq, d) for sq in range(64)] for d in DIRECTIONS]
+ROOK_RAYS = [RAYS[0][sq] | RAYS[1][sq] | RAYS[2][sq] | RAYS[3][sq] for sq in range(64)]
+BISHOP_RAYS = [RAYS[4][sq] | RAYS[5][sq] | RAYS[6][sq] | RAYS[7][sq] for sq in range(64)]
+
+
+def _between():
+   between = [[0] * 64 for sq in range(64)]
+   for a in range(64):
+      for j in range(len(DIRECTIONS)):
+         ray = RAYS[j][a]
+         bb = ray
+         while bb:
+            lsb = bb & -bb
+            bb ^= lsb
+            b = lsb.bit_length() - 1
+            # squares beyond b seen from a are exactly the ray from b in the same direction
+            between[a][b] = ray & ~RAYS[j][b] & ~lsb
+   return between
+
+
+# BETWEEN[a][b]: squares strictly between two squares on a common rank, file or diagonal, else 0
+BETWEEN = _between()
+
+
+def rookAttacks(sq, occupied):
+   south, east, north, west = RAYS[2][sq], RAYS[3][sq], RAYS[0][sq], RAYS[1][sq]
+   blockers = south & occupied
+   if blockers:
+      south ^= RAYS[2][(blockers & -blockers).bit_length() - 1]
+   blockers = east & occupied
+   if blockers:
+      east ^= RAYS[3][(blockers & -blockers).bit_length() - 1]
+   blockers = north & occupied
+   if blockers:
+      north ^= RAYS[0][blockers.bit_length() - 1]
+   blockers = west & occupied
+   if blockers:
+      west ^= RAYS[1][blockers.bit_length() - 1]
+   return south | east | north | west
+
+
+def bishopAttacks(sq, occupied):
+   southWest, southEast, northWest, northEast = RAYS[6][sq], RAYS[7][sq], RAYS[4][sq], RAYS[5][sq]
+   blockers = southWest & occupied
+   if blockers:
+      southWest ^= RAYS[6][(blockers & -blockers).bit_length() - 1]
+   blockers = southEast & occupied
+   if blockers:
+      southEast ^= RAYS[7][(blockers & -blockers).bit_length() - 1]
+   blockers = northWest & occupied
+   if blockers:
+      northWest ^= RAYS[4][blockers.bit_length() - 1]
+   blockers = northEast & occupied
+   if blockers:
+      northEast ^= RAYS[5][blockers.bit_length() - 1]
+   return southWest | southEast | northWest | northEast
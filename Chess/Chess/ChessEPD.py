@@ -0,0 +1,82 @@
+"""
+streaming epd reader. positions are parsed one line at a time, so suites with millions of entries never sit in
+memory at once. lines in plain fen form, with the two move counters, are accepted as well
+"""
+
+import gzip
+
+import ChessEngine
+
+
+def parseOperations(text):
+   """
+   splits the operations after the position, like 'bm Nf3; id "test 1";', into a dict of opcode -> list of operands.
+   semicolons and spaces inside double quotes are kept
+   """
+   operations = {}
+   operands = []
+   token = ''
+   quoted = False
+   opcode = None
+   for char in text + ';':
+      if quoted:
+         if char == '"':
+            quoted = False
+         else:
+            token += char
+         continue
+      if char == '"':
+         quoted = True
+      elif char in ' \t;':
+         if token:
+            if opcode is None:
+               opcode = token
+            else:
+               operands.append(token)
+            token = ''
+         if char == ';' and opcode is not None:
+            operations[opcode] = operands
+            opcode, operands = None, []
+      else:
+         token += char
+   return operations
+
+
+def parseEpdLine(line):
+   """
+   returns (fen, operations) for one line. hmvc and fmvn operations fill in the fen move counters
+   """
+   fields = line.split(None, 4)
+   if len(fields) < 4:
+      raise ValueError('epd line needs at least 4 fields: %r' % line)
+   rest = fields[4] if len(fields) == 5 else ''
+   counters = rest.split(None, 2)
+   if len(counters) >= 2 and counters[0].isdigit() and counters[1].isdigit():
+      # a full fen, the move counters come before any operations
+      operations = parseOperations(counters[2] if len(counters) == 3 else '')
+      return ' '.join(fields[:4] + counters[:2]), operations
+   operations = parseOperations(rest)
+   halfmoveClock = operations.get('hmvc', ['0'])[0]
+   fullmoveNumber = operations.get('fmvn', ['1'])[0]
+   return ' '.join(fields[:4] + [halfmoveClock, fullmoveNumber]), operations
+
+
+def readEpd(path):
+   """
+   generator over (fen, operations) of an epd file, skipping blank lines and # comments. files ending in .gz are read
+   compressed
+   """
+   opener = gzip.open if path.endswith('.gz') else open
+   with opener(path, 'rt') as f:
+      for line in f:
+         line = line.strip()
+         if line and not line.startswith('#'):
+            yield parseEpdLine(line)
+
+
+def readPositions(path):
+   """
+   generator over (GameState, operations). every position gets a fresh GameState, so they can be kept or handed on
+   """
+   for fen, operations in readEpd(path):
+      yield ChessEngine.GameState(fen), operations
@@ -2,8 +2,173 @@
 this class is responsible for storing all the information about the current state of a chess game
 """
 
+import random
+import struct
+
+from ChessEvaluation import PST, PHASE
+from ChessAttacks import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, ROOK_RAYS, BISHOP_RAYS, BETWEEN, \
+   rookAttacks, bishopAttacks
+
+# the position is kept as a 64 entry mailbox of piece indices plus bitboards: one 64 bit integer per piece
+# type and colour and occupancy masks. square index is row * 8 + col, so bit 0 is a8 and bit 63 is h1,
+# the same orientation as GameState.board
+
+FULL = 0xFFFFFFFFFFFFFFFF
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+NOT_FILE_A = FULL ^ FILE_A
+NOT_FILE_H = FULL ^ FILE_H
+ROW_0 = 0xFF
+ROW_2 = ROW_0 << 16
+ROW_5 = ROW_0 << 40
+ROW_7 = ROW_0 << 56
+PROMOTION_ROWS = ROW_0 | ROW_7
+
+WHITE = 0
+BLACK = 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+EMPTY = 12
+PIECES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK', '--')
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+
+# castling rights are a 4 bit mask. a move from or to one of the king or rook home squares clears the matching rights
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLE_RIGHTS = 15
+CASTLE_RIGHTS_MASK = [ALL_CASTLE_RIGHTS] * 64
+CASTLE_RIGHTS_MASK[0] ^= BLACK_QUEENSIDE
+CASTLE_RIGHTS_MASK[4] ^= BLACK_KINGSIDE | BLACK_QUEENSIDE
+CASTLE_RIGHTS_MASK[7] ^= BLACK_KINGSIDE
+CASTLE_RIGHTS_MASK[56] ^= WHITE_QUEENSIDE
+CASTLE_RIGHTS_MASK[60] ^= WHITE_KINGSIDE | WHITE_QUEENSIDE
+CASTLE_RIGHTS_MASK[63] ^= WHITE_KINGSIDE
+# (right, king square, king, rook square, rook): a right only means something while both stand at home
+CASTLE_HOMES = ((WHITE_KINGSIDE, 60, KING, 63, ROOK), (WHITE_QUEENSIDE, 60, KING, 56, ROOK),
+                (BLACK_KINGSIDE, 4, 6 + KING, 7, 6 + ROOK), (BLACK_QUEENSIDE, 4, 6 + KING, 0, 6 + ROOK))
+BACK_RANK_SQUARES = tuple(range(8)) + tuple(range(56, 64))
+# move counters are stored in 16 bits in snapshots
+MAX_COUNTER = 0xFFFF
+
+# encoded moves are plain ints: bits 0-5 start square, bits 6-11 end square, bits 12-15 flags.
+# the capture flag bit is also set for en passant and capturing promotions; the low two bits of a
+# promotion give the piece (knight, bishop, rook, queen)
+QUIET = 0
+DOUBLE_PAWN_PUSH = 1 << 12
+KING_CASTLE = 2 << 12
+QUEEN_CASTLE = 3 << 12
+CAPTURE = 4 << 12
+EN_PASSANT = 5 << 12
+PROMOTION = 8 << 12
+PROMOTION_PIECE_MASK = 3 << 12
+QUEEN_PROMOTION = PROMOTION | 3 << 12
+FLAGS_MASK = 15 << 12
+PROMOTION_PIECES = ('N', 'B', 'R', 'Q')
+
+# what generateMoves produces. captures include en passant and every promotion, quiets are all other moves, castling
+# included, so a search can try the captures before the quiet moves are even generated
+CAPTURE_MOVES = 1
+QUIET_MOVES = 2
+ALL_MOVES = CAPTURE_MOVES | QUIET_MOVES
+
+# zobrist keys: one random 64 bit number per piece and square, per castling rights combination,
+# per en passant file and for the side to move. a fixed seed keeps keys stable between runs
+_zobristRandom = random.Random(20231105)
+ZOBRIST_PIECES = [[_zobristRandom.getrandbits(64) for sq in range(64)] for piece in range(12)]
+ZOBRIST_CASTLE = [_zobristRandom.getrandbits(64) for rights in range(16)]
+ZOBRIST_EN_PASSANT = [_zobristRandom.getrandbits(64) for col in range(8)]
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+
+# everything makeMoveCode cannot work out backwards is pushed on GameState.stateStack as one int per ply: the zobrist
+# key in the low 64 bits and above it 4 bits each of captured piece (EMPTY for none), castling rights and en passant
+# file (8 for none, the rank follows from the side to move), then the halfmove clock. the small fields are put
+# together before they are shifted over the key, so only two operations work on the wide int
+STATE_KEY_BITS = 64
+STATE_KEY_MASK = (1 << STATE_KEY_BITS) - 1
+STATE_CASTLE_SHIFT = 4
+STATE_EN_PASSANT_SHIFT = 8
+STATE_HALFMOVE_SHIFT = 12
+NO_EN_PASSANT_FILE = 8
+STATE_FIELDS_MASK = (1 << STATE_HALFMOVE_SHIFT) - 1
+# the en passant field of the state for enPassantSquare + 1
+EN_PASSANT_STATE = [NO_EN_PASSANT_FILE << STATE_EN_PASSANT_SHIFT] + \
+                   [(sq & 7) << STATE_EN_PASSANT_SHIFT for sq in range(64)]
+
+
+def _decodeState(fields, us):
+   # the en passant square is on the sixth rank from the mover's side: row 2 for white, row 5 for black
+   epFile = fields >> STATE_EN_PASSANT_SHIFT
+   enPassantSquare = -1 if epFile >= NO_EN_PASSANT_FILE else (16 if us == WHITE else 40) + epFile
+   return (fields & 15, (fields >> STATE_CASTLE_SHIFT) & 15, enPassantSquare)
+
+# (captured piece, castling rights, en passant square) for the side to move and the 12 bits of small fields, one
+# lookup instead of taking them apart at every undo
+UNDO_STATE = [[_decodeState(fields, us) for fields in range(STATE_FIELDS_MASK + 1)] for us in (WHITE, BLACK)]
+
+# plies without a capture or pawn move after which the game is drawn
+FIFTY_MOVE_PLIES = 100
+
+# binary snapshot of a position: the 64 mailbox bytes, side to move in bit 0 and castling rights above it, the en
+# passant square (-1 for none), the halfmove clock, the fullmove number and the number of history moves, which follow
+# as 16 bit move codes. a snapshot without history always takes SNAPSHOT_SIZE bytes
+SNAPSHOT = struct.Struct('<64sBbHHH')
+SNAPSHOT_SIZE = SNAPSHOT.size
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+FEN_PIECES = 'PNBRQKpnbrqk'
+FEN_CASTLE = (('K', WHITE_KINGSIDE), ('Q', WHITE_QUEENSIDE), ('k', BLACK_KINGSIDE), ('q', BLACK_QUEENSIDE))
+
+
+def popCount(bb):
+   return bin(bb).count('1')
+
+
+def addMoves(moves, start, targets, theirs):
+   captures = targets & theirs
+   targets ^= captures
+   while captures:
+      lsb = captures & -captures
+      captures ^= lsb
+      moves.append(start | (lsb.bit_length() - 1) << 6 | CAPTURE)
+   while targets:
+      lsb = targets & -targets
+      targets ^= lsb
+      moves.append(start | (lsb.bit_length() - 1) << 6)
+
+
+def addPawnMoves(moves, targets, delta, flag):
+   """
+   adds a pawn move to every square of targets from the square delta away. reaching the last row is a promotion,
+   generated once per piece with the queen first
+   """
+   while targets:
+      lsb = targets & -targets
+      targets ^= lsb
+      end = lsb.bit_length() - 1
+      if lsb & (ROW_0 | ROW_7):
+         move = (end + delta) | end << 6 | flag | PROMOTION
+         moves.extend((move | 3 << 12, move | 2 << 12, move | 1 << 12, move))
+      else:
+         moves.append((end + delta) | end << 6 | flag)
+
+
+def squareName(sq):
+   return Move.colsToFiles[sq & 7] + Move.rowsToRanks[sq >> 3]
+
+
+def moveNotation(move):
+   """
+   coordinate notation of an encoded move, with the promotion piece appended as in uci (e7e8q)
+   """
+   notation = squareName(move & 63) + squareName((move >> 6) & 63)
+   if move & PROMOTION:
+      notation += PROMOTION_PIECES[(move >> 12) & 3].lower()
+   return notation
+
+
 class GameState():
-   def __init__(self):
+   def __init__(self, fen=None):
       self.board =  [
          ["bR" , "bN" , "bB" , "bQ" , "bK" , "bB" , "bN" , "bR"],
          ["bp" , "bp" , "bp" , "bp" , "bp" , "bp" , "bp" , "bp"],
@@ -15,490 +180,772 @@ class GameState():
          ["wR" , "wN" , "wB" , "wQ" , "wK" , "wB" , "wN" , "wR"]
       ]
 
-      self.moveFunctions = {'p': self.getPawnMoves, 'R': self.getRookMoves, 'N': self.getKnightMoves,
-                            'B': self.getBishopMoves, 'Q': self.getQueenMoves, 'K': self.getKingMoves}
-      
       self.moveLog = []
+      self.moveStack = []
+      # moveStack entries below the first move of moveLog, the history a snapshot brings along
+      self.moveLogBase = 0
       self.whiteToMove = True
-      self.whiteKingLocation = (7, 4)
-      self.blackKingLocation = (0, 4)
       self.inCheck = False
-      self.pins = []
-      self.checks = []
       self.checkmate = False
       self.stalemate = False
-      self.enPassantPossible = ()
-      self.currentCastlingRight = CastleRights(True, True, True, True)
-      self.whiteCastleKingside = True
-      self.whiteCastleQueenside = True
-      self.blackCastleKingside = True
-      self.blackCastleQueenside = True
-      self.castleRightsLog = [CastleRights(self.whiteCastleKingside, self.whiteCastleQueenside, self.blackCastleKingside, self.blackCastleQueenside)]
-      
-
+      self.enPassantSquare = -1
+      self.castleRights = ALL_CASTLE_RIGHTS
+      # one packed int of irreversible state per move on moveStack, see STATE_KEY_MASK
+      self.stateStack = []
+      # plies since the last capture or pawn move, and the move number as counted in fen
+      self.halfmoveClock = 0
+      self.fullmoveNumber = 1
+      self.initBitboards()
+      if fen is not None:
+         self.loadFen(fen)
+
+
+   @property
+   def board(self):
+      """
+      the position as the 8x8 grid of piece strings, rebuilt from the mailbox only after the position changed
+      """
+      if self.boardCache is None:
+         squares = self.squares
+         self.boardCache = [[PIECES[squares[r * 8 + c]] for c in range(8)] for r in range(8)]
+      return self.boardCache
+
+   @board.setter
+   def board(self, board):
+      self.squares = [PIECE_INDEX[board[r][c]] for r in range(8) for c in range(8)]
+      self.boardCache = None
+
+   @property
+   def whiteKingLocation(self):
+      sq = self.bitboards[KING].bit_length() - 1
+      return (sq >> 3, sq & 7)
+
+   @property
+   def blackKingLocation(self):
+      sq = self.bitboards[6 + KING].bit_length() - 1
+      return (sq >> 3, sq & 7)
+
+
+   def initBitboards(self):
+      """
+      rebuilds the bitboards, occupancy masks and zobrist key from the mailbox and the state flags, and starts the
+      repetition history over from this position
+      """
+      # white's packed middlegame / endgame score and the game phase are kept up to date move by move for
+      # ChessEvaluation, they are summed up in the same pass over the mailbox
+      bitboards = [0] * 12
+      score = phase = 0
+      for sq, piece in enumerate(self.squares):
+         if piece != EMPTY:
+            bitboards[piece] |= 1 << sq
+            score += PST[piece][sq]
+            phase += PHASE[piece]
+      self.bitboards = bitboards
+      self.pstScore = score
+      self.phase = phase
+      self.occupancy = [0, 0]
+      for i in range(6):
+         self.occupancy[WHITE] |= self.bitboards[i]
+         self.occupancy[BLACK] |= self.bitboards[i + 6]
+      self.occupied = self.occupancy[WHITE] | self.occupancy[BLACK]
+      self.zobristKey = self.computeZobristKey()
+      # how often each key occurred in the game so far, the current position included. makeMoveCode counts the new
+      # key up and undoMoveCode counts it back down, so a repetition check is one lookup however long the game is
+      self.positionCounts = {self.zobristKey: 1}
+
+
+   def loadFen(self, fen):
+      """
+      sets up the position of a fen string and clears the move history. the two move counters may be left out,
+      as they are in epd. raises ValueError for a malformed string
+      """
+      fields = fen.split()
+      if len(fields) not in (4, 6):
+         raise ValueError('fen needs 4 or 6 fields: %r' % fen)
+      rows = fields[0].split('/')
+      if len(rows) != 8:
+         raise ValueError('fen board needs 8 rows: %r' % fen)
+      squares = []
+      for row in rows:
+         for char in row:
+            if char.isdigit():
+               squares.extend([EMPTY] * int(char))
+            elif char in FEN_PIECES:
+               squares.append(FEN_PIECES.index(char))
+            else:
+               raise ValueError('bad piece %r in fen: %r' % (char, fen))
+         if len(squares) % 8:
+            raise ValueError('fen row does not have 8 squares: %r' % fen)
+      if squares.count(KING) != 1 or squares.count(6 + KING) != 1:
+         raise ValueError('fen needs one king per side: %r' % fen)
+      if fields[1] not in ('w', 'b'):
+         raise ValueError('bad side to move in fen: %r' % fen)
+      castleRights = 0
+      if fields[2] != '-':
+         for char in fields[2]:
+            rights = dict(FEN_CASTLE).get(char)
+            if rights is None:
+               raise ValueError('bad castling field in fen: %r' % fen)
+            castleRights |= rights
+      enPassantSquare = -1
+      if fields[3] != '-':
+         if len(fields[3]) != 2 or fields[3][0] not in Move.filesToCols or fields[3][1] != '63'[fields[1] == 'b']:
+            raise ValueError('bad en passant square in fen: %r' % fen)
+         enPassantSquare = Move.ranksToRows[fields[3][1]] * 8 + Move.filesToCols[fields[3][0]]
+      try:
+         halfmoveClock, fullmoveNumber = (int(fields[4]), int(fields[5])) if len(fields) == 6 else (0, 1)
+      except ValueError:
+         raise ValueError('bad move counters in fen: %r' % fen)
+      if not 0 <= halfmoveClock <= MAX_COUNTER or not 0 <= fullmoveNumber <= MAX_COUNTER:
+         raise ValueError('move counters out of range in fen: %r' % fen)
+
+      self.setPosition(squares, fields[1] == 'w', castleRights, enPassantSquare, halfmoveClock, max(1, fullmoveNumber))
+
+
+   def setPosition(self, squares, whiteToMove, castleRights, enPassantSquare, halfmoveClock, fullmoveNumber):
+      """
+      sets up a position from its parts and clears the move history, for loadFen and loadSnapshot. castling rights
+      whose king or rook is not at home are dropped. raises ValueError for a position the engine cannot play from:
+      pawns on the first or last rank, the side not to move in check, or an en passant square no pawn just passed,
+      and then leaves the object as it was
+      """
+      if any(squares[sq] == PAWN or squares[sq] == 6 + PAWN for sq in BACK_RANK_SQUARES):
+         raise ValueError('pawn on the first or last rank')
+      for right, kingSq, king, rookSq, rook in CASTLE_HOMES:
+         if squares[kingSq] != king or squares[rookSq] != rook:
+            castleRights &= ~right
+      if enPassantSquare >= 0:
+         # the pawn that passed stands in front of the square, seen from the side to move, and the squares it
+         # crossed are empty
+         if whiteToMove:
+            row, pawnSq, startSq, pawn = 2, enPassantSquare + 8, enPassantSquare - 8, 6 + PAWN
+         else:
+            row, pawnSq, startSq, pawn = 5, enPassantSquare - 8, enPassantSquare + 8, PAWN
+         if enPassantSquare >> 3 != row or squares[pawnSq] != pawn or squares[enPassantSquare] != EMPTY or \
+               squares[startSq] != EMPTY:
+            raise ValueError('no pawn can be taken en passant on %s' % squareName(enPassantSquare))
+      # the check test needs the bitboards, so the position is built on a blank object and only taken over once it
+      # passed
+      position = self.__class__.__new__(self.__class__)
+      position.squares = squares
+      position.boardCache = None
+      position.whiteToMove = whiteToMove
+      position.castleRights = castleRights
+      position.enPassantSquare = enPassantSquare
+      position.halfmoveClock = halfmoveClock
+      position.fullmoveNumber = fullmoveNumber
+      position.moveLog = []
+      position.moveStack = []
+      # moveStack entries below the first move of moveLog, the history a snapshot brings along
+      position.moveLogBase = 0
+      position.stateStack = []
+      position.inCheck = position.checkmate = position.stalemate = False
+      position.initBitboards()
+      us = WHITE if whiteToMove else BLACK
+      theirKing = position.bitboards[6 * (1 - us) + KING].bit_length() - 1
+      if position.attackersTo(theirKing, us, position.occupied):
+         raise ValueError('the side not to move is in check')
+      self.__dict__.update(position.__dict__)
+
+
+   def getFen(self):
+      """
+      the current position as a fen string
+      """
+      rows = []
+      for r in range(8):
+         row = ''
+         empty = 0
+         for piece in self.squares[r * 8:r * 8 + 8]:
+            if piece == EMPTY:
+               empty += 1
+               continue
+            if empty:
+               row += str(empty)
+               empty = 0
+            row += FEN_PIECES[piece]
+         rows.append(row + str(empty) if empty else row)
+      castle = ''.join(char for char, rights in FEN_CASTLE if self.castleRights & rights) or '-'
+      enPassant = squareName(self.enPassantSquare) if self.enPassantSquare >= 0 else '-'
+      return '%s %s %s %s %d %d' % ('/'.join(rows), 'w' if self.whiteToMove else 'b', castle, enPassant,
+                                     self.halfmoveClock, self.fullmoveNumber)
+
+
+   def enPassantKey(self, color):
+      """
+      the en passant file only goes into the key when a pawn of the given colour can actually capture there,
+      otherwise positions that are really the same would hash differently
+      """
+      ep = self.enPassantSquare
+      if ep >= 0 and PAWN_ATTACKS[1 - color][ep] & self.bitboards[6 * color + PAWN]:
+         return ZOBRIST_EN_PASSANT[ep & 7]
+      return 0
+
+
+   def computeZobristKey(self):
+      """
+      full recomputation of the key, makeMove keeps it up to date incrementally
+      """
+      key = 0
+      for piece in range(12):
+         bb = self.bitboards[piece]
+         while bb:
+            lsb = bb & -bb
+            bb ^= lsb
+            key ^= ZOBRIST_PIECES[piece][lsb.bit_length() - 1]
+      key ^= ZOBRIST_CASTLE[self.castleRights]
+      if self.whiteToMove:
+         key ^= self.enPassantKey(WHITE)
+      else:
+         key ^= self.enPassantKey(BLACK) ^ ZOBRIST_BLACK_TO_MOVE
+      return key
 
 
    def makeMove(self, move):
-      self.board[move.endRow][move.endCol] = move.pieceMoved
-      self.board[move.startRow][move.startCol] = "--"
+      """
+      plays a Move object, a promotion carries its piece in promotionChoice
+      """
       self.moveLog.append(move)
-      self.whiteToMove = not self.whiteToMove
-      if move.pieceMoved == 'wK':
-         self.whiteKingLocation = (move.endRow, move.endCol)
-      elif move.pieceMoved == 'bK':
-         self.blackKingLocation = (move.endRow, move.endCol)
-      # en passant
-      if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-         self.enPassantPossible = ((move.endRow + move.startRow) // 2, move.endCol)
-      else:
-         self.enPassantPossible = ()
-      if move.enPassant:
-         self.board[move.startRow][move.endCol] = "--"
-      if move.pawnPromotion:
-         promotedPiece = input("Promote to Q, R, B, or N:")
-         self.board[move.endRow][move.endCol] = move.pieceMoved[0] + promotedPiece
-      self.updateCastleRights(move)
-      self.castleRightsLog.append(CastleRights(self.whiteCastleKingside, self.blackCastleKingside, 
-                                               self.whiteCastleQueenside, self.blackCastleQueenside))
-      if move.castle:
-         if move.endCol - move.startCol == 2:
-            self.board[move.endRow][move.endCol - 1] = self.board[move.endRow][move.endCol + 1]
-            self.board[move.endRow][move.endCol + 1] = '--'
-         else:
-            self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 2]
-            self.board[move.endRow][move.endCol - 2] = '--'
-      
+      self.makeMoveCode(move.code)
 
-   
-   
 
    def undoMove(self):
-      if len(self.moveLog) != 0:
-         move = self.moveLog.pop()
-         self.board[move.startRow][move.startCol] = move.pieceMoved
-         self.board[move.endRow][move.endCol] = move.pieceCaptured
-         self.whiteToMove = not self.whiteToMove
-         if move.pieceMoved == 'wK':
-            self.whiteKingLocation = (move.startRow, move.startCol)
-         elif move.pieceMoved == 'bK':
-            self.blackKingLocation = (move.startRow, move.startCol)
-         if move.enPassant:
-            self.board[move.endRow][move.endCol] = "--"
-            self.board[move.startRow][move.endCol] = move.pieceCaptured
-            self.enPassantPossible = (move.endRow, move.endCol)
-         if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-            self.enPassantPossible = ()
-         if move.castle:
-            if move.endCol - move.startCol == 2: # Kingside castle
-                self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-1]
-                self.board[move.endRow][move.endCol-1] = '--'
-            else: # Queenside castle
-                self.board[move.endRow][move.endCol-2] = self.board[move.endRow][move.endCol+1]
-                self.board[move.endRow][move.endCol+1] = '--'
-         self.castleRightsLog.pop()
-         CastleRights = self.castleRightsLog[-1]
-         self.whiteCastleKingside = CastleRights.wks
-         self.blackCastleKingside = CastleRights.bks
-         self.whiteCastleQueenside = CastleRights.wqs
-         self.blackCastleQueenside = CastleRights.bqs
-   
-
-
-   def getValidMoves(self):
-      moves = []
-      self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+      if len(self.moveStack) != 0:
+         self.undoMoveCode()
+         # moves made through makeMove sit on moveStack above moveLogBase and below anything a search pushed
+         if self.moveLog and len(self.moveStack) < self.moveLogBase + len(self.moveLog):
+            self.moveLog.pop()
+         elif len(self.moveStack) < self.moveLogBase:
+            self.moveLogBase = len(self.moveStack)
+
+
+   def makeMoveCode(self, move):
+      start = move & 63
+      end = (move >> 6) & 63
+      flag = move & FLAGS_MASK
+      squares = self.squares
+      bitboards = self.bitboards
+      piece = squares[start]
       if self.whiteToMove:
-         kingRow = self.whiteKingLocation[0]
-         kingCol = self.whiteKingLocation[1]
+         us, them = WHITE, BLACK
       else:
-         kingRow = self.blackKingLocation[0]
-         kingCol = self.blackKingLocation[1]
-      if self.inCheck:
-         if len(self.checks) == 1:
-            moves = self.getAllPossibleMoves()
-            check = self.checks[0]
-            checkRow = check[0]
-            checkCol = check[1]
-            pieceChecking = self.board[checkRow][checkCol]
-            validSquares = []
-            if pieceChecking[1] == 'N':
-               validSquares = [(checkRow, checkCol)]
-            else:
-               for i in range(1, 8):
-                  validSquare = (kingRow + check[2] * i, kingCol + check[3] * i)
-                  validSquares.append(validSquare)
-                  if validSquare[0] == checkRow and validSquare[1] == checkCol:
-                     break
-            for i in range(len(moves) -1, -1, -1):
-               if moves[i].pieceMoved[1] != 'K':
-                  if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                     moves.remove(moves[i])
+         us, them = BLACK, WHITE
+      self.moveStack.append(move)
+      key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE ^ self.enPassantKey(us) ^ ZOBRIST_CASTLE[self.castleRights]
+      if flag == EN_PASSANT:
+         captureSq = end + 8 if us == WHITE else end - 8
+      else:
+         captureSq = end
+      captured = squares[captureSq]
+      self.stateStack.append((captured | self.castleRights << STATE_CASTLE_SHIFT |
+                              EN_PASSANT_STATE[self.enPassantSquare + 1] |
+                              self.halfmoveClock << STATE_HALFMOVE_SHIFT) << STATE_KEY_BITS | self.zobristKey)
+      pst = PST[piece]
+      score = self.pstScore + pst[end] - pst[start]
+      if captured != EMPTY:
+         squares[captureSq] = EMPTY
+         bitboards[captured] ^= 1 << captureSq
+         self.occupancy[them] ^= 1 << captureSq
+         key ^= ZOBRIST_PIECES[captured][captureSq]
+         score -= PST[captured][captureSq]
+         self.phase -= PHASE[captured]
+      moveBits = (1 << start) | (1 << end)
+      squares[start] = EMPTY
+      squares[end] = piece
+      bitboards[piece] ^= moveBits
+      self.occupancy[us] ^= moveBits
+      key ^= ZOBRIST_PIECES[piece][start] ^ ZOBRIST_PIECES[piece][end]
+      if flag & PROMOTION:
+         promoted = piece + ((flag >> 12) & 3) + KNIGHT
+         squares[end] = promoted
+         bitboards[piece] ^= 1 << end
+         bitboards[promoted] ^= 1 << end
+         key ^= ZOBRIST_PIECES[piece][end] ^ ZOBRIST_PIECES[promoted][end]
+         score += PST[promoted][end] - pst[end]
+         self.phase += PHASE[promoted]
+      elif flag == KING_CASTLE or flag == QUEEN_CASTLE:
+         if flag == KING_CASTLE:
+            rookStart, rookEnd = end + 1, end - 1
          else:
-            self.getKingMoves(kingRow, kingCol, moves)
+            rookStart, rookEnd = end - 2, end + 1
+         rook = piece - KING + ROOK
+         squares[rookEnd] = rook
+         squares[rookStart] = EMPTY
+         rookBits = (1 << rookStart) | (1 << rookEnd)
+         bitboards[rook] ^= rookBits
+         self.occupancy[us] ^= rookBits
+         key ^= ZOBRIST_PIECES[rook][rookStart] ^ ZOBRIST_PIECES[rook][rookEnd]
+         score += PST[rook][rookEnd] - PST[rook][rookStart]
+      self.pstScore = score
+      self.occupied = self.occupancy[WHITE] | self.occupancy[BLACK]
+      self.enPassantSquare = (start + end) >> 1 if flag == DOUBLE_PAWN_PUSH else -1
+      self.castleRights &= CASTLE_RIGHTS_MASK[start] & CASTLE_RIGHTS_MASK[end]
+      self.halfmoveClock = 0 if piece % 6 == PAWN or captured != EMPTY else self.halfmoveClock + 1
+      if us == BLACK:
+         self.fullmoveNumber += 1
+      self.whiteToMove = not self.whiteToMove
+      key ^= self.enPassantKey(them) ^ ZOBRIST_CASTLE[self.castleRights]
+      self.zobristKey = key
+      self.positionCounts[key] = self.positionCounts.get(key, 0) + 1
+      self.boardCache = None
+
+
+   def undoMoveCode(self):
+      move = self.moveStack.pop()
+      start = move & 63
+      end = (move >> 6) & 63
+      flag = move & FLAGS_MASK
+      squares = self.squares
+      bitboards = self.bitboards
+      self.whiteToMove = not self.whiteToMove
+      if self.whiteToMove:
+         us, them = WHITE, BLACK
       else:
-         moves = self.getAllPossibleMoves()
-      
+         us, them = BLACK, WHITE
+      piece = squares[end]
+      # the evaluation terms are taken back by the same table lookups as makeMoveCode made, with the signs turned
+      score = self.pstScore
+      if flag & PROMOTION:
+         bitboards[piece] ^= 1 << end
+         score -= PST[piece][end]
+         self.phase -= PHASE[piece]
+         piece = 6 * us + PAWN
+         bitboards[piece] ^= 1 << end
+         score += PST[piece][end]
+      elif flag == KING_CASTLE or flag == QUEEN_CASTLE:
+         if flag == KING_CASTLE:
+            rookStart, rookEnd = end + 1, end - 1
+         else:
+            rookStart, rookEnd = end - 2, end + 1
+         rook = piece - KING + ROOK
+         squares[rookStart] = rook
+         squares[rookEnd] = EMPTY
+         rookBits = (1 << rookStart) | (1 << rookEnd)
+         bitboards[rook] ^= rookBits
+         self.occupancy[us] ^= rookBits
+         score += PST[rook][rookStart] - PST[rook][rookEnd]
+      moveBits = (1 << start) | (1 << end)
+      squares[start] = piece
+      squares[end] = EMPTY
+      bitboards[piece] ^= moveBits
+      self.occupancy[us] ^= moveBits
+      pst = PST[piece]
+      score += pst[start] - pst[end]
+      # keys are dropped again once their count is back to zero, so the history only holds the game's own line
+      count = self.positionCounts.pop(self.zobristKey)
+      if count > 1:
+         self.positionCounts[self.zobristKey] = count - 1
+      key = self.stateStack.pop()
+      state = key >> STATE_KEY_BITS
+      captured, self.castleRights, self.enPassantSquare = UNDO_STATE[us][state & STATE_FIELDS_MASK]
+      if captured != EMPTY:
+         if flag == EN_PASSANT:
+            captureSq = end + 8 if us == WHITE else end - 8
+         else:
+            captureSq = end
+         squares[captureSq] = captured
+         bitboards[captured] ^= 1 << captureSq
+         self.occupancy[them] ^= 1 << captureSq
+         score += PST[captured][captureSq]
+         self.phase += PHASE[captured]
+      self.pstScore = score
+      self.occupied = self.occupancy[WHITE] | self.occupancy[BLACK]
+      self.halfmoveClock = state >> STATE_HALFMOVE_SHIFT
+      if us == BLACK:
+         self.fullmoveNumber -= 1
+      self.zobristKey = key & STATE_KEY_MASK
+      self.boardCache = None
+
+
+   def repetitionCount(self):
+      """
+      how often the current position occurred in the game, itself included. positions only repeat between two
+      irreversible moves, and a capture, a pawn move or lost castling rights change the key for good, so the count
+      never has to look further back than the last of them
+      """
+      return self.positionCounts[self.zobristKey]
+
+
+   def isRepetition(self):
+      """
+      the position occurred before. inside a search that is as good as a draw, the side that could avoid it will
+      """
+      return self.positionCounts[self.zobristKey] > 1
+
+
+   def isThreefoldRepetition(self):
+      return self.positionCounts[self.zobristKey] >= 3
+
+
+   def isFiftyMoveDraw(self):
+      """
+      fifty moves by each side without a capture or a pawn move. a mate on the last of them still wins, callers
+      check for that first
+      """
+      return self.halfmoveClock >= FIFTY_MOVE_PLIES
+
+
+   def historyMoves(self):
+      """
+      the move codes played since the last irreversible move, as far as moveStack goes back. nothing before them can
+      come up again, so they are all the history a repetition check needs
+      """
+      count = min(self.halfmoveClock, len(self.moveStack))
+      return self.moveStack[len(self.moveStack) - count:]
+
+
+   def writeSnapshot(self, buffer, offset=0, history=False):
+      """
+      packs the position into a writable buffer (bytearray, memoryview, shared memory) at offset, without building
+      any intermediate object, and returns the offset after it. with history the snapshot holds the position after
+      the last irreversible move and the moves since, so loading it restores the repetition history too
+      """
+      moves = self.historyMoves() if history else ()
+      for move in moves:
+         self.undoMoveCode()
+      try:
+         SNAPSHOT.pack_into(buffer, offset, bytes(self.squares), self.whiteToMove | self.castleRights << 1,
+                            self.enPassantSquare, self.halfmoveClock, self.fullmoveNumber, len(moves))
+      finally:
+         for move in moves:
+            self.makeMoveCode(move)
+      if moves:
+         struct.pack_into('<%dH' % len(moves), buffer, offset + SNAPSHOT_SIZE, *moves)
+      return offset + SNAPSHOT_SIZE + 2 * len(moves)
+
+
+   def toBytes(self, history=False):
+      """
+      the snapshot as bytes, SNAPSHOT_SIZE of them plus two per history move
+      """
+      buffer = bytearray(SNAPSHOT_SIZE + (2 * len(self.historyMoves()) if history else 0))
+      self.writeSnapshot(buffer, 0, history)
+      return bytes(buffer)
+
+
+   def loadSnapshot(self, buffer, offset=0):
+      """
+      sets up the position of a snapshot read straight from buffer at offset, and returns the offset after it. like
+      loadFen it clears the move history, apart from the moves the snapshot carries. raises ValueError for bytes
+      that do not hold a position, and then leaves the object as it was
+      """
+      try:
+         pieces, flags, enPassantSquare, halfmoveClock, fullmoveNumber, count = SNAPSHOT.unpack_from(buffer, offset)
+      except struct.error:
+         raise ValueError('not a position snapshot')
+      squares = list(pieces)
+      if max(squares) > EMPTY or squares.count(KING) != 1 or squares.count(6 + KING) != 1 or flags >= 32 or \
+            not -1 <= enPassantSquare < 64:
+         raise ValueError('not a position snapshot')
+      end = offset + SNAPSHOT_SIZE
+      try:
+         moves = struct.unpack_from('<%dH' % count, buffer, end)
+      except struct.error:
+         raise ValueError('not a position snapshot')
+      # replayed on a blank object as well, so a history move that does not fit the position cannot leave half of
+      # it behind. only the piece moved is checked, a full legality test would cost a move generation per move
+      position = self.__class__.__new__(self.__class__)
+      position.setPosition(squares, bool(flags & 1), flags >> 1, enPassantSquare, halfmoveClock, max(1, fullmoveNumber))
+      for move in moves:
+         if position.squares[move & 63] // 6 != (WHITE if position.whiteToMove else BLACK):
+            raise ValueError('not a position snapshot')
+         position.makeMoveCode(move)
+      position.moveLogBase = count
+      self.__dict__.update(position.__dict__)
+      return end + 2 * count
+
+
+   @classmethod
+   def fromSnapshot(cls, buffer, offset=0):
+      gs = cls.__new__(cls)
+      gs.loadSnapshot(buffer, offset)
+      return gs
+
+
+   def __getstate__(self):
+      # pickles as a snapshot with history, a few dozen bytes. Move objects in moveLog are gui bookkeeping and are
+      # not kept
+      return self.toBytes(history=True)
+
+
+   def __setstate__(self, state):
+      self.loadSnapshot(state)
+
+
+   def getValidMoves(self):
+      moves = self.generateMoves([])
+      board = self.board
+      moves = [Move.fromCode(move, board) for move in moves]
       if len(moves) == 0:
          if self.inCheck:
             self.checkmate = True
          else:
-            self.stalemate
+            self.stalemate = True
       else:
          self.checkmate = False
          self.stalemate = False
       return moves
 
 
-
-   def getAllPossibleMoves(self):
-      moves = []   
-      for r in range(len(self.board)):
-         for c in range(len(self.board[r])):
-            turn = self.board[r][c][0]
-            if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):               
-               piece = self.board[r][c][1] 
-               self.moveFunctions[piece](r, c, moves)
+   def generateMoves(self, moves, kinds=ALL_MOVES, targets=FULL):
+      """
+      appends the encoded legal moves of the side to move to moves and returns it. a search passes the same list
+      back in for every node at a given ply, so generation does not allocate any move objects. kinds picks captures,
+      quiet moves or both, targets limits the end squares, which makes checking a single move cheap
+      """
+      if self.whiteToMove:
+         us, them = WHITE, BLACK
+      else:
+         us, them = BLACK, WHITE
+      kingSq = self.bitboards[6 * us + KING].bit_length() - 1
+      checkers, checkMask, pinned, pinMasks = self.pinsAndChecks(us, kingSq)
+      self.inCheck = checkers != 0
+      pawnTargets = targets
+      if kinds == CAPTURE_MOVES:
+         targets &= self.occupancy[them]
+      elif kinds == QUIET_MOVES:
+         targets &= FULL ^ self.occupied
+      self.generateKingMoves(moves, us, kingSq, self.inCheck, targets, kinds & QUIET_MOVES)
+      if checkers & (checkers - 1):
+         # double check, only the king can move
+         return moves
+      # in single check the other pieces may only land on checkMask, the checker or a square between it and the king,
+      # so evasions come straight out of the generators instead of being filtered from the full list
+      if checkers:
+         targets &= checkMask
+         pawnTargets &= checkMask
+      self.generatePawnMoves(moves, us, pinned, pinMasks, pawnTargets, checkers, kinds)
+      self.generatePieceMoves(moves, us, pinned, pinMasks, targets)
       return moves
 
 
-
-   def getPawnMoves(self, r, c, moves):
-      piecePinned = False
-      pinDirection = ()
-      for i in range(len(self.pins)-1, -1, -1):
-         if self.pins[i][0] == r and self.pins[i][1] == c:
-            piecePinned = True
-            pinDirection = (self.pins[i][2], self.pins[i][3])
-            self.pins.remove(self.pins[i])
-            break
-
-      if self.whiteToMove:
-         moveAmount = -1
-         startRow = 6
-         backRow = 0
-         enemyColor = 'b'
+   def generatePawnMoves(self, moves, us, pinned, pinMasks, targets=FULL, checkers=0, kinds=ALL_MOVES):
+      """
+      targets limits the end squares, checkers lets en passant through when it takes the checking pawn off a square
+      outside targets. pushes to the last row count as captures, as all promotions do
+      """
+      pawns = self.bitboards[6 * us + PAWN]
+      theirs = self.occupancy[1 - us]
+      empty = FULL ^ self.occupied
+      pushTargets = captureTargets = targets
+      if kinds == CAPTURE_MOVES:
+         pushTargets &= PROMOTION_ROWS
+      elif kinds == QUIET_MOVES:
+         pushTargets &= ~PROMOTION_ROWS
+         captureTargets = 0
+      self.addPawnPushesAndCaptures(moves, pawns & ~pinned, us, empty, theirs, pushTargets, captureTargets)
+      pinnedPawns = pawns & pinned
+      while pinnedPawns:
+         lsb = pinnedPawns & -pinnedPawns
+         pinnedPawns ^= lsb
+         pinMask = pinMasks[lsb.bit_length() - 1]
+         self.addPawnPushesAndCaptures(moves, lsb, us, empty, theirs, pinMask & pushTargets, pinMask & captureTargets)
+      ep = self.enPassantSquare
+      if ep >= 0 and kinds & CAPTURE_MOVES and ((1 << ep) & targets or checkers & (1 << (ep + (8 if us == WHITE else -8)))):
+         attackers = PAWN_ATTACKS[1 - us][ep] & pawns
+         while attackers:
+            lsb = attackers & -attackers
+            attackers ^= lsb
+            start = lsb.bit_length() - 1
+            if lsb & pinned and not pinMasks[start] & (1 << ep):
+               continue
+            if self.enPassantIsLegal(start, ep):
+               moves.append(start | ep << 6 | EN_PASSANT)
+
+
+   def addPawnPushesAndCaptures(self, moves, pawns, us, empty, theirs, pushAllowed, captureAllowed):
+      theirs &= captureAllowed
+      if us == WHITE:
+         single = (pawns >> 8) & empty
+         double = ((single & ROW_5) >> 8) & empty & pushAllowed
+         addPawnMoves(moves, single & pushAllowed, 8, QUIET)
+         addPawnMoves(moves, double, 16, DOUBLE_PAWN_PUSH)
+         addPawnMoves(moves, (pawns >> 9) & NOT_FILE_H & theirs, 9, CAPTURE)
+         addPawnMoves(moves, (pawns >> 7) & NOT_FILE_A & theirs, 7, CAPTURE)
       else:
-         moveAmount = 1
-         startRow = 1
-         backRow = 7
-         enemyColor = 'w'
-      pawnPromotion = False
-
-      if self.board[r + moveAmount][c] == "--":
-         if not piecePinned or pinDirection == (moveAmount, 0):
-            if r + moveAmount == backRow:
-               pawnPromotion = True
-            moves.append(Move((r, c), (r + moveAmount, c), self.board, pawnPromotion = pawnPromotion))
-            if r == startRow and self.board[r + 2 * moveAmount][c] == "--":
-               moves.append(Move((r, c), (r + 2 * moveAmount, c), self.board))
-      if c - 1 >= 0:
-         if not piecePinned or pinDirection == (moveAmount, -1):
-            if self.board[r + moveAmount][c - 1][0] == enemyColor:
-               if r + moveAmount == backRow:
-                  pawnPromotion = True
-               moves.append(Move((r, c), (r + moveAmount, c - 1), self.board, pawnPromotion = pawnPromotion))
-            if (r + moveAmount, c - 1) == self.enPassantPossible:
-               moves.append(Move((r, c), (r + moveAmount, c - 1), self.board, enPassant = True))
-      if c + 1 <= 7:
-         if not piecePinned or pinDirection == (moveAmount, 1):
-            if self.board[r + moveAmount][c + 1][0] == enemyColor:
-               if r + moveAmount == backRow:
-                  pawnPromotion = True
-               moves.append(Move((r, c), (r + moveAmount, c + 1), self.board, pawnPromotion = pawnPromotion))
-            if (r + moveAmount, c + 1) == self.enPassantPossible:
-               moves.append(Move((r, c), (r + moveAmount, c + 1), self.board, enPassant = True))
-
-
-   def getRookMoves(self, r, c, moves):
-      piecePinned = False
-      pinDirection = ()
-      for i in range(len(self.pins)-1, -1, -1):
-         if self.pins[i][0] == r and self.pins[i][1] == c:
-            piecePinned = True
-            pinDirection = (self.pins[i][2], self.pins[i][3])
-            if self.board[r][c][1] != 'Q':
-               self.pins.remove(self.pins[i])
-            break
-      directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
-      enemyColor = "b" if self.whiteToMove else "w"
-      for d in directions:
-         for i in range(1, 8):
-            endRow = r + d[0] * i
-            endCol = c + d[1] * i
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-               if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                  endPiece = self.board[endRow][endCol]
-                  if endPiece == "--":
-                     moves.append(Move((r, c), (endRow, endCol), self.board))
-                  elif endPiece[0] == enemyColor:
-                     moves.append(Move((r, c), (endRow, endCol), self.board))
-                     break
-                  else:
-                     break
-            else:
-               break
+         single = (pawns << 8) & empty
+         double = ((single & ROW_2) << 8) & empty & pushAllowed
+         addPawnMoves(moves, single & pushAllowed, -8, QUIET)
+         addPawnMoves(moves, double, -16, DOUBLE_PAWN_PUSH)
+         addPawnMoves(moves, (pawns << 7) & NOT_FILE_H & theirs, -7, CAPTURE)
+         addPawnMoves(moves, (pawns << 9) & NOT_FILE_A & theirs, -9, CAPTURE)
+
+
+   def enPassantIsLegal(self, start, ep):
+      """
+      en passant removes two pawns at once, which can uncover a slider on the king that no pin test sees
+      """
       if self.whiteToMove:
-         if (r, c) == (7, 0):
-            if self.whiteCastleQueenside and self.board[7][1] == '--' and self.board[7][2] == '--' and self.board[7][3] == '--' and not self.squareUnderAttack(7, 2, 'b') and not self.squareUnderAttack(7, 3, 'b') and not self.whiteRooksMoved[0] and not self.whiteKingMoved:
-               moves.append(Move((r, c), (7, 2), self.board, isCastleMove=True))
-         elif (r, c) == (7, 7):
-            if self.whiteCastleKingside and self.board[7][5] == '--' and self.board[7][6] == '--' and not self.squareUnderAttack(7, 6, 'b') and not self.squareUnderAttack(7, 5, 'b') and not self.whiteRooksMoved[1] and not self.whiteKingMoved:
-               moves.append(Move((r, c), (7, 6), self.board, isCastleMove=True))
+         kingSq, enemy = self.bitboards[KING].bit_length() - 1, 6
       else:
-         if (r, c) == (0, 0):
-            if self.blackCastleQueenside and self.board[0][1] == '--' and self.board[0][2] == '--' and self.board[0][3] == '--' and not self.squareUnderAttack(0, 2, 'w') and not self.squareUnderAttack(0, 3, 'w') and not self.blackRooksMoved[0] and not self.blackKingMoved:
-                moves.append(Move((r, c), (0, 2), self.board, isCastleMove=True))
-         elif (r, c) == (0, 7):
-            if self.blackCastleKingside and self.board[0][5] == '--' and self.board[0][6] == '--' and not self.squareUnderAttack(0, 6, 'w') and not self.squareUnderAttack(0, 5, 'w') and not self.blackRooksMoved[1] and not self.blackKingMoved:
-                moves.append(Move((r, c), (0, 6), self.board, isCastleMove=True))
-
-
-
-
-   def getKnightMoves(self, r, c, moves):
-      piecePinned = False
-      for i in range(len(self.pins)-1, -1, -1):
-         if self.pins[i][0] == r and self.pins[i][1] == c:
-            piecePinned = True
-            self.pins.remove(self.pins[i])
-            break
-      knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-      allyColor = "w" if self.whiteToMove else "b"
-      for m in knightMoves:
-         endRow = r + m[0]
-         endCol = c + m[1]
-         if 0 <= endRow < 8 and 0 <= endCol < 8:
-            if not piecePinned:
-               endPiece = self.board[endRow][endCol]
-               if endPiece[0] != allyColor:
-                  moves.append(Move((r, c), (endRow, endCol), self.board))
-
-   def getBishopMoves(self, r, c, moves):
-      piecePinned = False
-      pinDirection = ()
-      for i in range(len(self.pins)-1, -1, -1):
-         if self.pins[i][0] == r and self.pins[i][1] == c:
-            piecePinned = True
-            pinDirection = (self.pins[i][2], self.pins[i][3])
-            self.pins.remove(self.pins[i])
-            break
-      directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))
-      enemyColor = "b" if self.whiteToMove else "w"
-      for d in directions:
-         for i in range(1, 8):
-            endRow = r + d[0] * i
-            endCol = c + d[1] * i
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-               if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                  endPiece = self.board[endRow][endCol]
-                  if endPiece == "--":
-                     moves.append(Move((r, c), (endRow, endCol), self.board))
-                  elif endPiece[0] == enemyColor:
-                     moves.append(Move((r, c), (endRow, endCol), self.board))
-                     break
-                  else:
-                     break
-            else:
-               break
-
-   def getQueenMoves(self, r, c, moves):
-      self.getRookMoves(r, c, moves)
-      self.getBishopMoves(r, c, moves)
-
-   def getKingMoves(self, r, c, moves):
-      rowMoves = (-1, -1, -1, 0, 0, 1, 1, 1)
-      colMoves = (-1, 0, 1, -1, 1, -1, 0, 1)
-      allyColor = 'w' if self.whiteToMove else "b"
-      for i in range(8):
-         endRow = r + rowMoves[i]
-         endCol = c + colMoves[i]
-         if 0 <= endRow < 8 and 0 <= endCol < 8:
-            endPiece = self.board[endRow][endCol]
-            if endPiece[0] != allyColor:
-               if allyColor == 'w':
-                  self.whiteKingLocation = (endRow, endCol)
-               else:
-                  self.blackKingLocation = (endRow, endCol)
-               inCheck, pins, checks = self.checkForPinsAndChecks()
-               if not inCheck:
-                  moves.append(Move((r, c), (endRow, endCol), self.board))
-               if allyColor == 'w':
-                  self.whiteKingLocation = (r, c)
-               else:
-                  self.blackKingLocation = (r, c)
-      self.getCastleMoves(r, c, moves, allyColor)
-   
-
-   def getCastleMoves(self, r, c, moves, allyColor):
-      inCheck = self.squareUnderAttack(r, c, allyColor)
-      if inCheck:
-         return
-      if (self.whiteToMove and self.whiteCastleKingside) or (not self.whiteToMove and self.blackCastleKingside):
-         self.getKingsideCastleMoves(r, c, moves, allyColor)
-      if (self.whiteToMove and self.whiteCastleQueenside) or (not self.whiteToMove and self.blackCastleQueenside):
-         self.getQueensideCastleMoves(r, c, moves, allyColor)
-
-   
-   def getKingsideCastleMoves(self, r, c, moves, allyColor):
-      if self.board[r][c + 1] == '--' and self.board[r][c + 2] == '--' and \
-       not self.squareUnderAttack(r, c + 1, allyColor) and not self.squareUnderAttack(r, c + 2, allyColor):
-         moves.append(Move((r, c), (r, c + 2), self.board, castle = True))
-
-   def getQueensideCastleMoves(self, r, c, moves, allyColor):
-      if self.board[r][c - 1] == '--' and self.board[r][c - 2] == '--' and self.board[r][c - 3] == '--' and \
-       not self.squareUnderAttack(r, c - 1, allyColor) and not self.squareUnderAttack(r, c - 2, allyColor):
-         moves.append(Move((r, c), (r, c - 2), self.board, castle = True))
-   
+         kingSq, enemy = self.bitboards[6 + KING].bit_length() - 1, 0
+      captureSq = (start & ~7) | (ep & 7)
+      occupied = (self.occupied ^ (1 << start) ^ (1 << captureSq)) | (1 << ep)
+      rooks = self.bitboards[enemy + ROOK] | self.bitboards[enemy + QUEEN]
+      bishops = self.bitboards[enemy + BISHOP] | self.bitboards[enemy + QUEEN]
+      return not (rookAttacks(kingSq, occupied) & rooks or bishopAttacks(kingSq, occupied) & bishops)
+
+
+   def generatePieceMoves(self, moves, us, pinned, pinMasks, targets=FULL):
+      base = 6 * us
+      bitboards = self.bitboards
+      notOurs = (FULL ^ self.occupancy[us]) & targets
+      theirs = self.occupancy[1 - us]
+      occupied = self.occupied
+      # a pinned knight can never stay on the pin line
+      knights = bitboards[base + KNIGHT] & ~pinned
+      while knights:
+         lsb = knights & -knights
+         knights ^= lsb
+         sq = lsb.bit_length() - 1
+         addMoves(moves, sq, KNIGHT_ATTACKS[sq] & notOurs, theirs)
+      bishops = bitboards[base + BISHOP] | bitboards[base + QUEEN]
+      while bishops:
+         lsb = bishops & -bishops
+         bishops ^= lsb
+         sq = lsb.bit_length() - 1
+         targets = bishopAttacks(sq, occupied) & notOurs
+         if lsb & pinned:
+            targets &= pinMasks[sq]
+         addMoves(moves, sq, targets, theirs)
+      rooks = bitboards[base + ROOK] | bitboards[base + QUEEN]
+      while rooks:
+         lsb = rooks & -rooks
+         rooks ^= lsb
+         sq = lsb.bit_length() - 1
+         targets = rookAttacks(sq, occupied) & notOurs
+         if lsb & pinned:
+            targets &= pinMasks[sq]
+         addMoves(moves, sq, targets, theirs)
+
+
+   def generateKingMoves(self, moves, us, kingSq, inCheck, targets=FULL, castling=True):
+      them = 1 - us
+      kingBit = 1 << kingSq
+      theirs = self.occupancy[them]
+      # the king must not shield the squares behind it from a slider, so take it off the board while testing
+      occupied = self.occupied ^ kingBit
+      steps = KING_ATTACKS[kingSq] & ~self.occupancy[us] & targets
+      while steps:
+         lsb = steps & -steps
+         steps ^= lsb
+         sq = lsb.bit_length() - 1
+         if not self.attackersTo(sq, them, occupied):
+            moves.append(kingSq | sq << 6 | (CAPTURE if lsb & theirs else QUIET))
+      if castling and not inCheck and targets & ((4 << kingSq) | (kingBit >> 2)):
+         self.getCastleMoves(moves, us, kingSq)
+
+
+   def getCastleMoves(self, moves, us, kingSq):
+      if us == WHITE:
+         kingside, queenside = WHITE_KINGSIDE, WHITE_QUEENSIDE
+      else:
+         kingside, queenside = BLACK_KINGSIDE, BLACK_QUEENSIDE
+      if self.castleRights & kingside and not ((3 << (kingSq + 1)) & self.occupied) and \
+            not self.attackersTo(kingSq + 1, 1 - us, self.occupied) and not self.attackersTo(kingSq + 2, 1 - us, self.occupied):
+         moves.append(kingSq | (kingSq + 2) << 6 | KING_CASTLE)
+      if self.castleRights & queenside and not ((7 << (kingSq - 3)) & self.occupied) and \
+            not self.attackersTo(kingSq - 1, 1 - us, self.occupied) and not self.attackersTo(kingSq - 2, 1 - us, self.occupied):
+         moves.append(kingSq | (kingSq - 2) << 6 | QUEEN_CASTLE)
+
+
+   def isInCheck(self):
+      """
+      whether the side to move is in check, without generating any moves
+      """
+      us = WHITE if self.whiteToMove else BLACK
+      return self.attackersTo(self.bitboards[6 * us + KING].bit_length() - 1, 1 - us, self.occupied) != 0
+
+
+   def attackersTo(self, sq, color, occupied):
+      """
+      bitboard of the pieces of the given colour that attack sq, with sliders blocked by occupied
+      """
+      base = 6 * color
+      bitboards = self.bitboards
+      attackers = (PAWN_ATTACKS[1 - color][sq] & bitboards[base + PAWN]) | \
+                  (KNIGHT_ATTACKS[sq] & bitboards[base + KNIGHT]) | \
+                  (KING_ATTACKS[sq] & bitboards[base + KING])
+      # only run a slider lookup when such a slider stands somewhere on the empty-board rays of sq
+      rooks = (bitboards[base + ROOK] | bitboards[base + QUEEN]) & ROOK_RAYS[sq]
+      if rooks:
+         attackers |= rookAttacks(sq, occupied) & rooks
+      bishops = (bitboards[base + BISHOP] | bitboards[base + QUEEN]) & BISHOP_RAYS[sq]
+      if bishops:
+         attackers |= bishopAttacks(sq, occupied) & bishops
+      return attackers
 
-   def squareUnderAttack(self, r, c, allyColor):
-      enemyColor = 'w' if allyColor == 'b' else 'b'
-      directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-      for j in range(len(directions)):
-         d = directions[j]
-         for i in range(1, 8):
-            endRow = r + d[0] * i
-            endCol = c + d[1] * i
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-               endPiece = self.board[endRow][endCol]
-               if endPiece[0] == allyColor:
-                  break
-               elif endPiece[0] == enemyColor:
-                  type = endPiece[1]
-                    # If the enemy piece is a rook and the direction is horizontal or vertical
-                    # or if the enemy piece is a bishop and the direction is diagonal
-                    # or if the enemy piece is a queen and the direction is horizontal, vertical or diagonal
-                    # or if the enemy piece is a pawn and it can attack in the direction
-                    # or if the enemy piece is a king and it can attack in the direction
-                    # then the square is under attack
-                  if (0 <= j <= 3 and type == 'R') or \
-                        (4 <= j <= 7 and type == 'B') or \
-                        (i == 1 and type == 'p' and ((enemyColor == 'w' and 6 <= j <= 7) or (enemyColor == 'b' and 4 <= j <= 5))) or \
-                        (type == 'Q') or (i == 1 and type == 'K'):
-                     return True
-                  else:
-                     break
-            else:
-               break
-      knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-      for m in knightMoves:
-         endRow = r + m[0]
-         endCol = r + m[1]
-         if 0 <= endRow < 8 and 0 <= endCol < 8:
-            endPiece = self.board[endRow][endCol]
-            if endPiece[0] == enemyColor and endPiece[1] == 'N':
-               return True
-      return False
 
+   def squareUnderAttack(self, r, c, allyColor):
+      enemy = BLACK if allyColor == 'w' else WHITE
+      return self.attackersTo(r * 8 + c, enemy, self.occupied) != 0
+
+
+   def pinsAndChecks(self, us, kingSq):
+      """
+      returns (checkers, checkMask, pinned, pinMasks): the pieces giving check, the squares that capture or block a single
+      check, our pinned pieces and for each pinned square the line it may still move along
+      """
+      them = 1 - us
+      base = 6 * them
+      bitboards = self.bitboards
+      checkers = (PAWN_ATTACKS[us][kingSq] & bitboards[base + PAWN]) | (KNIGHT_ATTACKS[kingSq] & bitboards[base + KNIGHT])
+      checkMask = checkers
+      pinned = 0
+      pinMasks = {}
+      # enemy sliders that would hit the king on an empty board: with nothing between they check,
+      # with exactly one of our pieces between that piece is pinned
+      snipers = ((bitboards[base + ROOK] | bitboards[base + QUEEN]) & ROOK_RAYS[kingSq]) | \
+                ((bitboards[base + BISHOP] | bitboards[base + QUEEN]) & BISHOP_RAYS[kingSq])
+      occupied = self.occupied
+      ours = self.occupancy[us]
+      between = BETWEEN[kingSq]
+      while snipers:
+         lsb = snipers & -snipers
+         snipers ^= lsb
+         sq = lsb.bit_length() - 1
+         blockers = between[sq] & occupied
+         if not blockers:
+            checkers |= lsb
+            checkMask |= between[sq] | lsb
+         elif not blockers & (blockers - 1) and blockers & ours:
+            pinned |= blockers
+            pinMasks[blockers.bit_length() - 1] = between[sq] | lsb
+      return checkers, checkMask, pinned, pinMasks
 
 
    def checkForPinsAndChecks(self):
+      """
+      returns (inCheck, pins, checks) for the side to move, with pins and checks as (row, col, row step, col step) tuples
+      """
+      us = WHITE if self.whiteToMove else BLACK
+      kingSq = self.bitboards[6 * us + KING].bit_length() - 1
+      checkers, checkMask, pinned, pinMasks = self.pinsAndChecks(us, kingSq)
+      kingRow, kingCol = kingSq >> 3, kingSq & 7
       pins = []
+      for sq in pinMasks:
+         dr, dc = (sq >> 3) - kingRow, (sq & 7) - kingCol
+         pins.append((sq >> 3, sq & 7, (dr > 0) - (dr < 0), (dc > 0) - (dc < 0)))
       checks = []
-      inCheck = False
-      if self.whiteToMove:
-         enemyColor = "b"
-         allyColor = "w"
-         startRow = self.whiteKingLocation[0]
-         startCol = self.whiteKingLocation[1]
-      else:
-         enemyColor = "w"
-         allyColor = "b"
-         startRow = self.blackKingLocation[0]
-         startCol = self.blackKingLocation[1]
-      directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-      for j in range(len(directions)):
-         d = directions[j]
-         possiblePin = ()
-         for i in range(1, 8):
-            endRow = startRow + d[0] * i
-            endCol = startCol + d[1] * i
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-               endPiece = self.board[endRow][endCol]
-               if endPiece[0] == allyColor and endPiece[1] != 'K':
-                  if possiblePin == ():
-                     possiblePin = (endRow, endCol, d[0], d[1])
-                  else:
-                     break
-               elif endPiece[0] == enemyColor:
-                  type = endPiece[1]
-                  if (0 <= j <= 3 and type == 'R') or \
-                        (4 <= j <= 7 and type == 'B') or \
-                        (i == 1 and type == 'p' and ((enemyColor == 'w' and 6 <= j <= 7) or (enemyColor == 'b' and 4 <= j <= 5))) or \
-                        (type == 'Q') or (i == 1 and type == 'K'):
-                     if possiblePin == ():
-                        inCheck = True
-                        checks.append((endRow, endCol, d[0], d[1]))
-                        break
-                     else: 
-                        pins.append(possiblePin)
-                        break
-                  else:
-                     break
-            else:
-               break
-      knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-      for m in knightMoves:
-         endRow = startRow + m[0]
-         endCol = startCol + m[1]
-         if 0 <= endRow < 8 and 0 <= endCol < 8:
-            endPiece = self.board[endRow][endCol]
-            if endPiece[0] == enemyColor and endPiece[1] == 'N':
-               inCheck = True
-               checks.append((endRow, endCol, m[0], m[1]))
-      return inCheck, pins, checks
-   
-
-   def updateCastleRights(self, move):
-      if move.pieceMoved == 'wK':
-         self.whiteCastleQueenside = False
-         self.whiteCastleKingside = False
-      elif move.pieceMoved == 'bK':
-         self.blackCastleQueenside = False
-         self.blackCastleKingside = False
-      elif move.pieceMoved == 'wR':
-         if move.startRow == 7:
-            if move.startCol == 7:
-               self.whiteCastleKingside = False
-            elif move.startCol == 0:
-               self.whiteCastleQueenside = False
-         if move.startRow == 0 and move.startCol == 0:
-            self.blackCastleQueenside = False
-         elif move.startRow == 0 and move.startCol == 7:
-            self.blackCastleKingside = False
-      elif move.pieceMoved == 'bR':
-         if move.startRow == 0:
-            if move.startCol == 7:
-               self.blackCastleKingside = False
-            elif move.startCol == 0:
-               self.blackCastleQueenside = False
-         if move.startRow == 7 and move.startCol == 0:
-            self.whiteCastleQueenside = False
-         elif move.startRow == 7 and move.startCol == 7:
-            self.whiteCastleKingside = False
-      if move.pieceCaptured == 'wR':
-            if move.endRow == 7:
-                if move.endCol == 0:
-                    self.currentCastlingRight.wqs = False
-                elif move.endCol == 7:
-                    self.currentCastlingRight.wks = False
-      elif move.pieceCaptured == 'bR':
-         if move.endRow == 0:
-            if move.endCol == 0:
-               self.currentCastlingRight.bqs = False
-            elif move.endCol == 7:
-               self.currentCastlingRight.bks = False
-
-
-class CastleRights():
-   def __init__(self, wks, bks, wqs, bqs):
-      self.wks = wks
-      self.bks = bks
-      self.wqs = wqs
-      self.bqs = bqs
-
-
-      
+      while checkers:
+         lsb = checkers & -checkers
+         checkers ^= lsb
+         sq = lsb.bit_length() - 1
+         dr, dc = (sq >> 3) - kingRow, (sq & 7) - kingCol
+         if self.squares[sq] % 6 != KNIGHT:
+            dr, dc = (dr > 0) - (dr < 0), (dc > 0) - (dc < 0)
+         checks.append((sq >> 3, sq & 7, dr, dc))
+      return len(checks) > 0, pins, checks
+
+
+
 class Move():
+   """
+   move as seen by the gui and notation code. the engine itself works on the int in self.code
+   """
+
+   __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured', 'enPassant',
+                'pawnPromotion', 'castle', 'promotionChoice', 'moveID', 'code')
 
    ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
                    "5": 3, "6": 2, "7": 1, "8": 0}
@@ -507,7 +954,7 @@ class Move():
                    "e": 4, "f": 5, "g": 6, "h": 7}
    colsToFiles = {v: k for k, v in filesToCols.items()}
 
-   def __init__(self, startSq, endSq, board, enPassant=False, pawnPromotion=False, castle=False):
+   def __init__(self, startSq, endSq, board, enPassant=False, pawnPromotion=False, castle=False, promotionChoice='Q'):
       self.startRow = startSq[0]
       self.startCol = startSq[1]
       self.endRow = endSq[0]
@@ -515,22 +962,49 @@ class Move():
       self.pieceMoved = board[self.startRow][self.startCol]
       self.pieceCaptured = board[self.endRow][self.endCol]
       self.enPassant = enPassant
-      self.pawnPromotion = pawnPromotion
+      # a pawn reaching the last row always promotes, also when the move was built from two clicks
+      self.pawnPromotion = pawnPromotion or (self.pieceMoved[1:] == 'p' and self.endRow in (0, 7))
       self.castle = castle
+      self.promotionChoice = promotionChoice if self.pawnPromotion else None
       if enPassant:
          self.pieceCaptured = 'bp' if self.pieceMoved == 'wp' else 'wp'
       self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
-      print(self.moveID)
+      if self.pawnPromotion:
+         # the four promotions on one square are different moves
+         self.moveID += (PROMOTION_PIECES.index(promotionChoice) + 1) * 10000
+      if castle:
+         flag = KING_CASTLE if self.endCol > self.startCol else QUEEN_CASTLE
+      elif enPassant:
+         flag = EN_PASSANT
+      else:
+         flag = CAPTURE if self.pieceCaptured != "--" else QUIET
+         if self.pawnPromotion:
+            flag |= PROMOTION | PROMOTION_PIECES.index(promotionChoice) << 12
+         elif self.pieceMoved[1] == 'p' and abs(self.endRow - self.startRow) == 2:
+            flag = DOUBLE_PAWN_PUSH
+      self.code = (self.startRow * 8 + self.startCol) | (self.endRow * 8 + self.endCol) << 6 | flag
+
+   @classmethod
+   def fromCode(cls, code, board):
+      start = code & 63
+      end = (code >> 6) & 63
+      flag = code & FLAGS_MASK
+      move = cls((start >> 3, start & 7), (end >> 3, end & 7), board, enPassant = flag == EN_PASSANT,
+                 pawnPromotion = flag & PROMOTION != 0, castle = flag == KING_CASTLE or flag == QUEEN_CASTLE,
+                 promotionChoice = PROMOTION_PIECES[(code >> 12) & 3])
+      move.code = code
+      return move
 
    def __eq__(self, other):
       if isinstance(other, Move):
          return self.moveID == other.moveID
       return False
 
-   
+
    def getChessNotation(self):
-      return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+      notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+      return notation + self.promotionChoice.lower() if self.pawnPromotion else notation
 
    def getRankFile(self, r, c):
       return self.colsToFiles[c] + self.rowsToRanks[r]
-   
+
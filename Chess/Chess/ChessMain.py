@@ -2,16 +2,25 @@
 this is our main driver file. it will be responsible for handling user input and displaying the current gamestate object
 """
 
+import argparse
+import os
+
 import pygame as P
 
 import ChessEngine
+import ChessPGN
+from ChessSearch import formatScore
+from ChessWorker import EngineWorker
 
 
 WIDTH = HEIGHT = 512
+STATUS_HEIGHT = 24
 DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15 
 IMAGES = {}
+# how many moves of the principal variation the status line shows
+STATUS_PV_MOVES = 6
 
 '''
 Initialize a global dictionary of images
@@ -20,15 +29,24 @@ Initialize a global dictionary of images
 def loadImages():
     pieces = ['wp' ,'wR' ,'wN' ,'wB' ,'wQ' ,'wK' ,'bp' ,'bR' ,'bN' ,'bB' ,'bQ' ,'bK']
     for piece in pieces:
-        IMAGES[piece] = P.transform.scale(P.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
+        IMAGES[piece] = P.transform.scale(P.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE)).convert_alpha()
 
 '''
 the main driver
 '''
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='play chess')
+    parser.add_argument('--white', choices=('human', 'engine'), default='human', help='who plays white (default human)')
+    parser.add_argument('--black', choices=('human', 'engine'), default='engine', help='who plays black (default engine)')
+    parser.add_argument('--movetime', type=float, default=2.0, help='engine seconds per move (default 2)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='engine processes (default: one per cpu)')
+    parser.add_argument('--hash', type=int, default=16, help='engine transposition table in MB (default 16)')
+    args = parser.parse_args(argv)
+    humanPlays = {True: args.white == 'human', False: args.black == 'human'}  # keyed by gs.whiteToMove
+
     P.init()
-    screen = P.display.set_mode((WIDTH, HEIGHT))
+    screen = P.display.set_mode((WIDTH, HEIGHT + STATUS_HEIGHT))
     clock = P.time.Clock()
     screen.fill(P.Color("white"))
     gs = ChessEngine.GameState()
@@ -37,173 +55,303 @@ def main():
     moveLog = []  # Initialize an empty move log
     animate = False
     loadImages()
+    renderer = BoardRenderer(screen)
     running = True
     sqSelected = ()
     playerClicks = []  # Initialize as a list
     gameOver = False
-    
-    while running:
-        for e in P.event.get():
-            if e.type == P.QUIT:
-                running = False
-            elif e.type == P.MOUSEBUTTONDOWN:
-                if not gameOver:
+    promotionPiece = 'Q'  # piece a pawn promotes to, cycled with the p key
+    # the engine searches in its own process and the loop only polls it, so frames keep coming while it thinks
+    engine = EngineWorker(args.workers, args.hash) if not all(humanPlays.values()) else None
+    status = ''
+    engineFailed = False  # set when a search fails, the engine is not asked again until a take back or reset
+
+    try:
+        while running:
+            humanTurn = humanPlays[gs.whiteToMove]
+            for e in P.event.get():
+                if e.type == P.QUIT:
+                    running = False
+                elif e.type == P.MOUSEBUTTONDOWN:
                     location = P.mouse.get_pos()
-                    col = location[0]//SQ_SIZE
-                    row = location[1]//SQ_SIZE
-                    if sqSelected == (row, col):
+                    if not gameOver and humanTurn and location[1] < HEIGHT:
+                        col = location[0]//SQ_SIZE
+                        row = location[1]//SQ_SIZE
+                        if sqSelected == (row, col):
+                            sqSelected = ()
+                            playerClicks = []
+                        else:                
+                            sqSelected = (row, col)
+                            playerClicks.append(sqSelected)  # Append to the list
+                        if len(playerClicks) == 2:
+                            move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board, promotionChoice=promotionPiece)
+                            print(move.getChessNotation())
+                            for i in range(len(validMoves)):
+                                if move == validMoves[i]:
+                                    gs.makeMove(validMoves[i])
+                                    moveLog.append(validMoves[i])  # Add the move to the move log
+                                    moveMade = True
+                                    animate = True
+                                    sqSelected = ()
+                                    playerClicks = []
+                                    break
+                            if not moveMade:
+                                playerClicks = [sqSelected]
+                elif e.type == P.KEYDOWN:
+                    if e.key == P.K_z:
+                        if engine is not None:
+                            engine.cancel()
+                        if len(moveLog) > 0:
+                            gs.undoMove()
+                            moveLog.pop()  # Remove the last move from the move log
+                            # against the engine take back its reply as well, so it is the human's turn again
+                            if not humanPlays[gs.whiteToMove] and humanPlays[not gs.whiteToMove] and len(moveLog) > 0:
+                                gs.undoMove()
+                                moveLog.pop()
+                            moveMade = True
+                            animate = False
+                        gameOver = False
+                        engineFailed = False
                         sqSelected = ()
                         playerClicks = []
-                    else:                
-                        sqSelected = (row, col)
-                        playerClicks.append(sqSelected)  # Append to the list
-                    if len(playerClicks) == 2:
-                        move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
-                        print(move.getChessNotation())
-                        for i in range(len(validMoves)):
-                            if move == validMoves[i]:
-                                gs.makeMove(validMoves[i])
-                                moveLog.append(validMoves[i])  # Add the move to the move log
-                                moveMade = True
-                                animate = True
-                                sqSelected = ()
-                                playerClicks = []
-                        if not moveMade:
-                            playerClicks = [sqSelected]
-                # Move the following block outside of the 'elif' block for MOUSEBUTTONDOWN event
-            elif e.type == P.KEYDOWN:
-                if e.key == P.K_z:
-                    if len(moveLog) > 0:
-                        gs.undoMove()
-                        moveLog.pop()  # Remove the last move from the move log
-                        moveMade = True
+                    if e.key == P.K_r:
+                        if engine is not None:
+                            engine.cancel()
+                        gs = ChessEngine.GameState()
+                        validMoves = gs.getValidMoves()
+                        moveLog = []
+                        sqSelected = ()
+                        playerClicks = []
+                        moveMade = False
                         animate = False
-                if e.key == P.K_r:
-                    gs = ChessEngine.GameState()
-                    validMoves = gs.getValidMoves()
-                    sqSelected = ()
-                    playerClicks = []
-                    moveMade = False
-                    animate = False
-
-        if moveMade:
-            if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
-            validMoves = gs.getValidMoves()
-            moveMade = False
-            animate = False
-
-        drawBoard(screen)
-        drawPieces(screen, gs.board)
-        drawGameState(screen, gs, validMoves, sqSelected, moveLog)  # Pass the moveLog argument
-        
-        if gs.checkmate:
-            gameOver = True
-            if gs.whiteToMove:
-                drawText(screen, 'Black wins by Checkmate')
-            else:
-                drawText(screen, 'White wins by Checkmate')
-        elif gs.stalemate:
-            gameOver = True
-            drawText(screen, 'Stalemate')
-        
-        P.display.flip()
-        clock.tick(MAX_FPS)
-        
+                        gameOver = False
+                        engineFailed = False
+                        status = ''
+                    if e.key == P.K_p:
+                        pieces = ChessEngine.PROMOTION_PIECES
+                        promotionPiece = pieces[(pieces.index(promotionPiece) - 1) % len(pieces)]
+
+            if engine is not None:
+                for kind, result in engine.poll():
+                    if kind == 'error':
+                        status = 'engine error: ' + result
+                        engineFailed = True
+                        continue
+                    if result.pv:
+                        status = engineStatus(gs, result)
+                    if kind == 'done' and result.bestMove is not None:
+                        move = ChessEngine.Move.fromCode(result.bestMove, gs.board)
+                        gs.makeMove(move)
+                        moveLog.append(move)
+                        moveMade = True
+                        animate = True
+
+            if moveMade:
+                if animate:
+                    renderer.animateMove(gs.moveLog[-1], gs.board, clock)
+                validMoves = gs.getValidMoves()
+                moveMade = False
+                animate = False
+
+            text = None
+            if gs.checkmate:
+                gameOver = True
+                if gs.whiteToMove:
+                    text = 'Black wins by Checkmate'
+                else:
+                    text = 'White wins by Checkmate'
+            elif gs.stalemate:
+                gameOver = True
+                text = 'Stalemate'
+            elif gs.isThreefoldRepetition():
+                gameOver = True
+                text = 'Draw by Repetition'
+            elif gs.isFiftyMoveDraw():
+                gameOver = True
+                text = 'Draw by Fifty-Move Rule'
+
+            if engine is not None and not gameOver and not engineFailed and not humanPlays[gs.whiteToMove] and not engine.busy:
+                engine.start(gs, timeLimit=args.movetime)
 
-def highlightSquares(Screen, gs, validMoves, sqSelected, moveLog):
-    if sqSelected != ():
-        r, c = sqSelected
-        if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):
-            s = P.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100)
-            s.fill(P.Color('#9C780D'))
-            Screen.blit(s, (c * SQ_SIZE, r * SQ_SIZE))
-            s.set_alpha(0)
-            s.fill(P.Color('#b1781c'))
-            for move in validMoves:
-                if move.startRow == r and move.startCol == c:
-                    destR, destC = move.endRow, move.endCol
-                    if gs.board[destR][destC] == "--":  # Check if the square is empty
-                        dotSurface = P.Surface((SQ_SIZE, SQ_SIZE), P.SRCALPHA)
-                        dotSurface.set_alpha(90)
-                        P.draw.circle(dotSurface, P.Color('#444654'), (int(SQ_SIZE / 2), int(SQ_SIZE / 2)), 10)
-                        Screen.blit(dotSurface, (destC * SQ_SIZE, destR * SQ_SIZE))
-                    elif gs.board[destR][destC][0] == ('b' if gs.whiteToMove else 'w'):  # Check if the square is occupied by an enemy piece
-                        highlightSurface = P.Surface((SQ_SIZE, SQ_SIZE), P.SRCALPHA)
-                        highlightSurface.set_alpha(150)
-                        highlightSurface.fill(P.Color('#0E66AA'))
-                        P.draw.circle(highlightSurface, P.Color('#FF000000'), (int(SQ_SIZE / 2), int(SQ_SIZE / 2)), 37, 0)
-                        Screen.blit(highlightSurface, (destC * SQ_SIZE, destR * SQ_SIZE))
-    if moveLog:
-        lastMove = moveLog[-1]
-        startR, startC = lastMove.startRow, lastMove.startCol
-        endR, endC = lastMove.endRow, lastMove.endCol
-        lastMoveSurface = P.Surface((SQ_SIZE, SQ_SIZE), P.SRCALPHA)
-        lastMoveSurface.set_alpha(70)
-        lastMoveSurface.fill(P.Color('#D0C011'))
-        Screen.blit(lastMoveSurface, (startC * SQ_SIZE, startR * SQ_SIZE))
-        Screen.blit(lastMoveSurface, (endC * SQ_SIZE, endR * SQ_SIZE))
-    if gs.inCheck:
-        kingRow, kingCol = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
-        kingSurface = P.Surface((SQ_SIZE, SQ_SIZE), P.SRCALPHA)
-        kingSurface.set_alpha(150)
-        kingSurface.fill(P.Color('#A50D0D'))
-        P.draw.circle(kingSurface, P.Color('#FF000000'), (int(SQ_SIZE/2), int(SQ_SIZE/2)), 34, 0)
-        Screen.blit(kingSurface, (kingCol * SQ_SIZE, kingRow * SQ_SIZE))
-    
+            dirty = renderer.draw(gs, validMoves, sqSelected, moveLog, text)
+            statusRect = renderer.drawStatus(status, promotionPiece if any(humanPlays.values()) else None)
+            if statusRect:
+                dirty.append(statusRect)
+            if dirty:
+                P.display.update(dirty)
+            clock.tick(MAX_FPS)
+    finally:
+        if engine is not None:
+            engine.close()
+
+
+def engineStatus(gs, result):
+    """
+    one line on the engine's thinking: depth, score, speed and the start of the principal variation in san
+    """
+    pv = result.pv[:STATUS_PV_MOVES]
+    return 'depth %d  %s  %d knps  %s' % (result.depth, formatScore(result.score), result.nps() // 1000,
+                                          ' '.join(ChessPGN.sanMoves(gs, pv)))
         
-                    
-
-def drawGameState(screen, gs, validMoves, sqSelected, moveLog):
-    drawBoard(screen)
-    highlightSquares(screen, gs, validMoves, sqSelected, moveLog)
-    drawPieces(screen, gs.board)
-
-
-def drawBoard(screen):
-    global colors
-    colors = [P.Color("#f0d9b5"), P.Color("#b58863")]
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            color = colors[(r+c)%2]
-            P.draw.rect(screen, color, P.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-def drawPieces(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != "--":
-                screen.blit(IMAGES[piece], P.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-
-def animateMove(move, screen, board, clock):
-    global colors
-    dR = move.endRow - move.startRow
-    dC = move.endCol - move.startCol
-    framesPerSquare = 10
-    frameCount = (abs(dR) + abs(dC)) * framesPerSquare
-    for frame in range(frameCount + 1):
-        r, c = ((move.startRow + dR * frame/frameCount, move.startCol + dC * frame/frameCount))
-        drawBoard(screen)
-        drawPieces(screen, board)
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSquare = P.Rect(move.endCol * SQ_SIZE, move.endRow * SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        P.draw.rect(screen, color, endSquare)
-        if move.pieceCaptured != '--':
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
-        screen.blit(IMAGES[move.pieceMoved], P.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        P.display.flip()
-        clock.tick(480)
-
-
-def drawText(screen, text):
-    font = P.font.SysFont("Helvitca", 32, True, False)
-    textObject = font.render(text, 0, P.Color('gray'))
-    textLocation = P.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width()/2, HEIGHT/2 - textObject.get_height()/2)
-    screen.blit(textObject, textLocation)
-    textObject = font.render(text, 0, P.Color('black'))
-    screen.blit(textObject, textLocation.move(2, 2))
+
+class BoardRenderer():
+    """
+    draws the game with as little work per frame as possible: the board is rendered once, highlight overlays, fonts
+    and text are built once and cached, and each frame only the squares whose contents changed are redrawn and sent
+    to the display with display.update(rects)
+    """
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.boardSurface = self.renderBoard()
+        self.overlays = self.renderOverlays()
+        self.font = P.font.SysFont("Helvitca", 32, True, False)
+        self.statusFont = P.font.SysFont("Helvitca", 18, False, False)
+        self.status = None
+        self.textSurfaces = {}
+        # what every square showed in the last frame, None forces a redraw
+        self.shown = [None] * (DIMENSION * DIMENSION)
+        self.text = None
+
+    def renderBoard(self):
+        surface = P.Surface((WIDTH, HEIGHT)).convert()
+        colors = [P.Color("#f0d9b5"), P.Color("#b58863")]
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                P.draw.rect(surface, colors[(r + c) % 2], P.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+        return surface
+
+    def renderOverlays(self):
+        center = (int(SQ_SIZE / 2), int(SQ_SIZE / 2))
+        selected = P.Surface((SQ_SIZE, SQ_SIZE))
+        selected.set_alpha(100)
+        selected.fill(P.Color('#9C780D'))
+        dot = P.Surface((SQ_SIZE, SQ_SIZE), P.SRCALPHA)
+        dot.set_alpha(90)
+        P.draw.circle(dot, P.Color('#444654'), center, 10)
+        capture = P.Surface((SQ_SIZE, SQ_SIZE), P.SRCALPHA)
+        capture.set_alpha(150)
+        capture.fill(P.Color('#0E66AA'))
+        P.draw.circle(capture, P.Color('#FF000000'), center, 37, 0)
+        lastMove = P.Surface((SQ_SIZE, SQ_SIZE), P.SRCALPHA)
+        lastMove.set_alpha(70)
+        lastMove.fill(P.Color('#D0C011'))
+        check = P.Surface((SQ_SIZE, SQ_SIZE), P.SRCALPHA)
+        check.set_alpha(150)
+        check.fill(P.Color('#A50D0D'))
+        P.draw.circle(check, P.Color('#FF000000'), center, 34, 0)
+        return {'selected': selected, 'dot': dot, 'capture': capture, 'lastMove': lastMove, 'check': check}
+
+    def invalidate(self):
+        self.shown = [None] * (DIMENSION * DIMENSION)
+
+    def squareStates(self, gs, validMoves, sqSelected, moveLog):
+        """
+        for every square the piece on it and the overlays over it, in drawing order
+        """
+        board = gs.board
+        overlays = [[] for i in range(DIMENSION * DIMENSION)]
+        if sqSelected != ():
+            r, c = sqSelected
+            if board[r][c][0] == ('w' if gs.whiteToMove else 'b'):
+                overlays[r * DIMENSION + c].append('selected')
+                for move in validMoves:
+                    if move.startRow == r and move.startCol == c:
+                        destR, destC = move.endRow, move.endCol
+                        if board[destR][destC] == "--":
+                            overlays[destR * DIMENSION + destC].append('dot')
+                        elif board[destR][destC][0] == ('b' if gs.whiteToMove else 'w'):
+                            overlays[destR * DIMENSION + destC].append('capture')
+        if moveLog:
+            lastMove = moveLog[-1]
+            overlays[lastMove.startRow * DIMENSION + lastMove.startCol].append('lastMove')
+            overlays[lastMove.endRow * DIMENSION + lastMove.endCol].append('lastMove')
+        if gs.inCheck:
+            kingRow, kingCol = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
+            overlays[kingRow * DIMENSION + kingCol].append('check')
+        return [(board[sq // DIMENSION][sq % DIMENSION], tuple(overlays[sq])) for sq in range(DIMENSION * DIMENSION)]
+
+    def drawSquare(self, r, c, piece, overlays=()):
+        rect = P.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        self.screen.blit(self.boardSurface, rect, rect)
+        for overlay in overlays:
+            self.screen.blit(self.overlays[overlay], rect)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], rect)
+        return rect
+
+    def draw(self, gs, validMoves, sqSelected, moveLog, text=None):
+        """
+        brings the screen up to date and returns the rectangles that changed
+        """
+        if text != self.text:
+            # the text sits across many squares, putting it up or taking it down redraws all of them
+            self.invalidate()
+            self.text = text
+        dirty = []
+        for sq, state in enumerate(self.squareStates(gs, validMoves, sqSelected, moveLog)):
+            if state != self.shown[sq]:
+                self.shown[sq] = state
+                dirty.append(self.drawSquare(sq // DIMENSION, sq % DIMENSION, *state))
+        if dirty and text:
+            dirty.append(self.drawText(text))
+        return dirty
+
+    def drawText(self, text):
+        if text not in self.textSurfaces:
+            self.textSurfaces[text] = (self.font.render(text, 0, P.Color('gray')), self.font.render(text, 0, P.Color('black')))
+        shadow, textObject = self.textSurfaces[text]
+        textLocation = P.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width()/2, HEIGHT/2 - textObject.get_height()/2)
+        self.screen.blit(shadow, textLocation)
+        self.screen.blit(textObject, textLocation.move(2, 2))
+        return textLocation.inflate(4, 4)
+
+    def drawStatus(self, status, promotionPiece=None):
+        """
+        the line under the board, only redrawn when it says something new. returns its rectangle if it was drawn.
+        promotionPiece, the piece a human's pawn promotes to, is shown at the right end
+        """
+        if (status, promotionPiece) == self.status:
+            return None
+        self.status = (status, promotionPiece)
+        rect = P.Rect(0, HEIGHT, WIDTH, STATUS_HEIGHT)
+        self.screen.fill(P.Color("white"), rect)
+        if status:
+            textObject = self.statusFont.render(status, True, P.Color('black'))
+            self.screen.blit(textObject, rect.move(4, (STATUS_HEIGHT - textObject.get_height()) // 2))
+        if promotionPiece:
+            textObject = self.statusFont.render('promote to ' + promotionPiece, True, P.Color('gray40'))
+            self.screen.blit(textObject, rect.move(WIDTH - 4 - textObject.get_width(),
+                                                   (STATUS_HEIGHT - textObject.get_height()) // 2))
+        return rect
+
+    def animateMove(self, move, board, clock):
+        """
+        slides the moved piece over the board, which already shows the position after the move. each frame only the
+        squares under the piece's old and new place are repainted
+        """
+        dR = move.endRow - move.startRow
+        dC = move.endCol - move.startCol
+        framesPerSquare = 10
+        frameCount = (abs(dR) + abs(dC)) * framesPerSquare
+        previous = None
+        for frame in range(frameCount + 1):
+            r, c = ((move.startRow + dR * frame/frameCount, move.startCol + dC * frame/frameCount))
+            pieceRect = P.Rect(int(c * SQ_SIZE), int(r * SQ_SIZE), SQ_SIZE, SQ_SIZE)
+            area = pieceRect.union(previous) if previous else pieceRect
+            for row in range(area.top // SQ_SIZE, min(DIMENSION, (area.bottom - 1) // SQ_SIZE + 1)):
+                for col in range(area.left // SQ_SIZE, min(DIMENSION, (area.right - 1) // SQ_SIZE + 1)):
+                    if (row, col) == (move.endRow, move.endCol):
+                        # the end square shows what stood there until the piece arrives
+                        self.drawSquare(row, col, move.pieceCaptured if not move.enPassant else "--")
+                    else:
+                        self.drawSquare(row, col, board[row][col])
+            self.screen.blit(IMAGES[move.pieceMoved], pieceRect)
+            P.display.update(area)
+            previous = pieceRect
+            clock.tick(480)
+        self.invalidate()
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
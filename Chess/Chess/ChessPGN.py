@@ -0,0 +1,257 @@
+"""
+pgn reading and writing and standard algebraic notation. games are read and written one at a time through generators,
+so a database of any size is processed in constant memory
+"""
+
+import re
+
+import ChessEngine
+
+SAN_PIECES = ('', 'N', 'B', 'R', 'Q', 'K')
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+# the seven tag roster goes first, in this order, other tags follow in the order they were set
+TAG_ROSTER = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+LINE_WIDTH = 80
+
+SAN_PATTERN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+TAG_PATTERN = re.compile(r'^\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+TOKEN_PATTERN = re.compile(r'\s*([{}();]|[^\s{}();]+)')
+MOVE_NUMBER_PATTERN = re.compile(r'^\d+\.*')
+
+
+class PgnGame():
+   """
+   one game as read from a pgn file: tags in file order, moves as san strings and the result token
+   """
+
+   def __init__(self, headers=None, moves=None, result='*'):
+      self.headers = headers if headers is not None else {}
+      self.moves = moves if moves is not None else []
+      self.result = result
+
+   def startFen(self):
+      return self.headers.get('FEN', ChessEngine.START_FEN)
+
+
+def moveToSan(gs, move, legalMoves=None):
+   """
+   san of an encoded legal move in the position gs, with disambiguation and + or # appended.
+   legalMoves may pass in the already generated moves of gs to save generating them again
+   """
+   if legalMoves is None:
+      legalMoves = gs.generateMoves([])
+   start = move & 63
+   end = (move >> 6) & 63
+   flag = move & ChessEngine.FLAGS_MASK
+   pieceType = gs.squares[start] % 6
+   if flag == ChessEngine.KING_CASTLE:
+      san = 'O-O'
+   elif flag == ChessEngine.QUEEN_CASTLE:
+      san = 'O-O-O'
+   elif pieceType == ChessEngine.PAWN:
+      san = ChessEngine.squareName(end)
+      if move & ChessEngine.CAPTURE:
+         san = ChessEngine.squareName(start)[0] + 'x' + san
+      if move & ChessEngine.PROMOTION:
+         san += '=' + ChessEngine.PROMOTION_PIECES[(move >> 12) & 3]
+   else:
+      # other pieces of the same kind that can reach the same square decide how much of the start square is needed
+      rivals = [other & 63 for other in legalMoves if (other >> 6) & 63 == end and other & 63 != start and
+                gs.squares[other & 63] % 6 == pieceType]
+      disambiguation = ''
+      if rivals:
+         startName = ChessEngine.squareName(start)
+         if all(rival & 7 != start & 7 for rival in rivals):
+            disambiguation = startName[0]
+         elif all(rival >> 3 != start >> 3 for rival in rivals):
+            disambiguation = startName[1]
+         else:
+            disambiguation = startName
+      san = SAN_PIECES[pieceType] + disambiguation + ('x' if move & ChessEngine.CAPTURE else '') + \
+            ChessEngine.squareName(end)
+   inCheck = gs.inCheck
+   gs.makeMoveCode(move)
+   replies = gs.generateMoves([])
+   if gs.inCheck:
+      san += '+' if replies else '#'
+   gs.undoMoveCode()
+   gs.inCheck = inCheck
+   return san
+
+
+def sanToMove(gs, san, legalMoves=None):
+   """
+   the encoded legal move that san stands for in the position gs. raises ValueError if san is malformed, illegal
+   or ambiguous
+   """
+   if legalMoves is None:
+      legalMoves = gs.generateMoves([])
+   text = san.rstrip('+#!?')
+   if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+      flag = ChessEngine.KING_CASTLE if len(text) == 3 else ChessEngine.QUEEN_CASTLE
+      for move in legalMoves:
+         if move & ChessEngine.FLAGS_MASK == flag:
+            return move
+      raise ValueError('illegal castling %r' % san)
+   match = SAN_PATTERN.match(text)
+   if match is None:
+      raise ValueError('malformed san %r' % san)
+   piece, fromFile, fromRank, target, promotion = match.groups()
+   pieceType = SAN_PIECES.index(piece) if piece else ChessEngine.PAWN
+   end = ChessEngine.Move.ranksToRows[target[1]] * 8 + ChessEngine.Move.filesToCols[target[0]]
+   candidates = []
+   for move in legalMoves:
+      start = move & 63
+      if (move >> 6) & 63 != end or gs.squares[start] % 6 != pieceType:
+         continue
+      if fromFile and ChessEngine.Move.filesToCols[fromFile] != start & 7:
+         continue
+      if fromRank and ChessEngine.Move.ranksToRows[fromRank] != start >> 3:
+         continue
+      if move & ChessEngine.PROMOTION and ChessEngine.PROMOTION_PIECES[(move >> 12) & 3] != (promotion or 'Q'):
+         continue
+      candidates.append(move)
+   if len(candidates) != 1:
+      raise ValueError('%s san %r' % ('ambiguous' if candidates else 'illegal', san))
+   return candidates[0]
+
+
+def readGames(f):
+   """
+   generator over the games of an open pgn file. only the game being read is held in memory; comments, variations
+   and numeric annotation glyphs are skipped
+   """
+   game = PgnGame()
+   inMovetext = False
+   inComment = False
+   variationDepth = 0
+   for line in f:
+      if not inComment and line.startswith('%'):
+         continue
+      if not inComment and variationDepth == 0 and line.startswith('['):
+         tag = TAG_PATTERN.match(line)
+         if tag:
+            if inMovetext:
+               # a game without a result token ends where the next one starts
+               yield game
+               game = PgnGame()
+               inMovetext = False
+            game.headers[tag.group(1)] = tag.group(2).replace('\\"', '"').replace('\\\\', '\\')
+            continue
+      pos = 0
+      while pos < len(line):
+         if inComment:
+            end = line.find('}', pos)
+            if end < 0:
+               break
+            inComment = False
+            pos = end + 1
+            continue
+         token = TOKEN_PATTERN.match(line, pos)
+         if token is None:
+            break
+         pos = token.end()
+         token = token.group(1)
+         if token == '{':
+            inComment = True
+         elif token == ';':
+            break
+         elif token == '(':
+            variationDepth += 1
+         elif token == ')':
+            variationDepth = max(0, variationDepth - 1)
+         elif variationDepth or token.startswith('$'):
+            continue
+         elif token in RESULTS:
+            game.result = token
+            yield game
+            game = PgnGame()
+            inMovetext = False
+         else:
+            token = MOVE_NUMBER_PATTERN.sub('', token)
+            if token:
+               game.moves.append(token)
+               inMovetext = True
+   if inMovetext or game.headers:
+      yield game
+
+
+def replayGame(game, gs=None):
+   """
+   plays the moves of a PgnGame on gs, a new GameState at the game's start position by default, and yields every
+   encoded move right after it is made. raises ValueError on the first move that is not legal
+   """
+   if gs is None:
+      gs = ChessEngine.GameState(game.startFen())
+   moves = []
+   for san in game.moves:
+      moves.clear()
+      gs.generateMoves(moves)
+      move = sanToMove(gs, san, moves)
+      gs.makeMoveCode(move)
+      yield move
+
+
+def sanMoves(gs, moves):
+   """
+   san of a sequence of encoded moves played from gs. the moves are made and taken back, gs is left as it was
+   """
+   sans = []
+   inCheck = gs.inCheck
+   for move in moves:
+      sans.append(moveToSan(gs, move))
+      gs.makeMoveCode(move)
+   for move in moves:
+      gs.undoMoveCode()
+   gs.inCheck = inCheck
+   return sans
+
+
+def formatGame(game):
+   """
+   a PgnGame as pgn text: tags, then the movetext wrapped at LINE_WIDTH columns, ending with the result
+   """
+   headers = dict(game.headers)
+   headers['Result'] = game.result
+   lines = []
+   for name in TAG_ROSTER:
+      lines.append('[%s "%s"]' % (name, _escape(headers.pop(name, '?'))))
+   for name, value in headers.items():
+      lines.append('[%s "%s"]' % (name, _escape(value)))
+   lines.append('')
+   fields = game.startFen().split()
+   whiteToMove = fields[1] == 'w'
+   moveNumber = int(fields[5]) if len(fields) == 6 else 1
+   tokens = []
+   for i, san in enumerate(game.moves):
+      if whiteToMove:
+         tokens.append('%d.' % moveNumber)
+      elif i == 0:
+         tokens.append('%d...' % moveNumber)
+      tokens.append(san)
+      if not whiteToMove:
+         moveNumber += 1
+      whiteToMove = not whiteToMove
+   tokens.append(game.result)
+   line = ''
+   for token in tokens:
+      if line and len(line) + 1 + len(token) > LINE_WIDTH:
+         lines.append(line)
+         line = token
+      else:
+         line = line + ' ' + token if line else token
+   lines.append(line)
+   return '\n'.join(lines) + '\n'
+
+
+def writeGames(f, games):
+   """
+   writes PgnGames from any iterable, a generator included, to an open file with a blank line between games
+   """
+   for game in games:
+      f.write(formatGame(game))
+      f.write('\n')
+
+
+def _escape(value):
+   return value.replace('\\', '\\\\').replace('"', '\\"')
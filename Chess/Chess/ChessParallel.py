@@ -0,0 +1,177 @@
+"""
+multi-core perft and search. the gil keeps threads from running move generation side by side, so the work is split at
+the root and handed to a pool of processes. results are merged in a fixed order, never in the order workers finish
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import ChessEngine
+import ChessPerft
+from ChessSearch import Searcher, SearchResult, MAX_PLY, formatInfo
+from ChessTransposition import TranspositionTable, GENERATION_MASK
+
+# per process state of a search worker, filled in once by _initWorker
+_worker = {}
+
+
+def _perftTask(fen, move, depth):
+   gs = ChessEngine.GameState(fen)
+   gs.makeMoveCode(move)
+   return ChessPerft.perft(gs, depth)
+
+
+def parallelDivide(gs, depth, workers=None):
+   """
+   divide with one pool task per root move. pairs come back in move generation order, like ChessPerft.divide
+   """
+   fen = gs.getFen()
+   moves = gs.generateMoves([])
+   with ProcessPoolExecutor(workers) as executor:
+      counts = executor.map(_perftTask, [fen] * len(moves), moves, [depth - 1] * len(moves))
+      return [(ChessEngine.moveNotation(move), count) for move, count in zip(moves, counts)]
+
+
+def parallelPerft(gs, depth, workers=None):
+   if depth <= 1:
+      return ChessPerft.perft(gs, depth)
+   return sum(count for notation, count in parallelDivide(gs, depth, workers))
+
+
+def _initWorker(name, hashMB, infoQueue):
+   shm = shared_memory.SharedMemory(name=name)
+   tableBytes = TranspositionTable.bytesFor(hashMB)
+   _worker['shm'] = shm
+   _worker['searcher'] = Searcher(TranspositionTable(hashMB, shm.buf), stopSignal=shm.buf[tableBytes:tableBytes + 1])
+   _worker['infoQueue'] = infoQueue
+
+
+def _searchTask(snapshot, maxDepth, timeLimit, nodeLimit, generation, reportInfo, startDepth):
+   searcher = _worker['searcher']
+   # every worker ages the shared table to the same generation
+   searcher.tt.generation = generation
+   # queues pickle in the background, so the queued result must not be the one the search goes on changing
+   searcher.infoCallback = (lambda result: _worker['infoQueue'].put(result.copy())) if reportInfo else None
+   return searcher.search(ChessEngine.GameState.fromSnapshot(snapshot), maxDepth, timeLimit, nodeLimit, startDepth)
+
+
+def mergeResults(results):
+   """
+   one SearchResult from those of all workers: the deepest completed iteration wins, ties go to the lowest worker
+   index, so the main worker decides whenever the helpers did not get further
+   """
+   best = max(range(len(results)), key=lambda i: (results[i].depth, -i))
+   chosen = results[best]
+   return SearchResult(chosen.bestMove, chosen.score, chosen.depth, sum(result.nodes for result in results),
+                       max(result.seconds for result in results), chosen.pv)
+
+
+class ParallelSearcher():
+   """
+   lazy smp: every worker runs an iterative deepening search on the same position, and all of them share one
+   transposition table in shared memory, so each one cuts off on what the others already searched. the odd numbered
+   helpers start one ply deeper, so they stay an iteration ahead of the main worker and fill the table with the
+   entries its next iteration asks for instead of the ones it is writing itself. the pool and the
+   table live as long as the searcher, call close() or use it as a context manager. infoCallback gets the
+   iterations finished by the main worker, like Searcher's
+   """
+
+   def __init__(self, workers=None, hashMB=16, infoCallback=None):
+      self.workers = workers or os.cpu_count() or 1
+      self.infoCallback = infoCallback
+      self.hashMB = hashMB
+      tableBytes = TranspositionTable.bytesFor(hashMB)
+      # the byte after the table is the stop flag every worker polls
+      self.shm = shared_memory.SharedMemory(create=True, size=tableBytes + 1)
+      self.stopOffset = tableBytes
+      self.generation = 0
+      self.infoQueue = multiprocessing.Queue()
+      self.executor = ProcessPoolExecutor(self.workers, initializer=_initWorker,
+                                          initargs=(self.shm.name, hashMB, self.infoQueue))
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exc):
+      self.close()
+
+   def search(self, gs, maxDepth=MAX_PLY, timeLimit=None, nodeLimit=None):
+      """
+      same arguments and result as Searcher.search. nodeLimit is shared out evenly between the workers. the stop
+      flag is left as it is, like a Searcher's stopSignal, so a stop sent before the search gets going still counts;
+      call reset() before every search but the first
+      """
+      # the position goes to every worker as a snapshot with its repetition history, a few dozen bytes
+      snapshot = gs.toBytes(history=True)
+      workerNodes = max(1, nodeLimit // self.workers) if nodeLimit else None
+      reportInfo = self.infoCallback is not None
+      futures = [self.executor.submit(_searchTask, snapshot, maxDepth, timeLimit, workerNodes, self.generation,
+                                      reportInfo and i == 0, 1 + (i & 1)) for i in range(self.workers)]
+      self.generation = (self.generation + 1) & GENERATION_MASK
+      # every worker stops on the same limits, so the first one to finish ends the search; a helper that completed
+      # maxDepth ahead of the main worker has done all that was asked
+      while not any(future.done() for future in futures):
+         try:
+            info = self.infoQueue.get(timeout=0.05)
+         except queue.Empty:
+            continue
+         if self.infoCallback is not None:
+            self.infoCallback(info)
+      self.stop()
+      results = [future.result() for future in futures]
+      while reportInfo:
+         try:
+            info = self.infoQueue.get_nowait()
+         except queue.Empty:
+            break
+         self.infoCallback(info)
+      return mergeResults(results)
+
+   def stop(self):
+      self.shm.buf[self.stopOffset] = 1
+
+   def reset(self):
+      """
+      clears the stop flag, for the caller to do before a new search
+      """
+      self.shm.buf[self.stopOffset] = 0
+
+   def close(self):
+      self.stop()
+      self.executor.shutdown()
+      self.shm.close()
+      self.shm.unlink()
+
+
+def main(argv=None):
+   parser = argparse.ArgumentParser(description='parallel perft and search')
+   parser.add_argument('mode', choices=('perft', 'search'))
+   parser.add_argument('--fen', default=ChessEngine.START_FEN, help='position (default: start position)')
+   parser.add_argument('--depth', type=int, default=5, help='perft or search depth (default 5)')
+   parser.add_argument('--movetime', type=float, help='search time limit in seconds')
+   parser.add_argument('--workers', type=int, help='worker processes (default: one per cpu)')
+   parser.add_argument('--hash', type=int, default=16, help='shared transposition table in MB (default 16)')
+   args = parser.parse_args(argv)
+
+   gs = ChessEngine.GameState(args.fen)
+   start = time.perf_counter()
+   if args.mode == 'perft':
+      nodes = parallelPerft(gs, args.depth, args.workers)
+      seconds = time.perf_counter() - start
+      print('nodes %d  %.2fs  %d nps' % (nodes, seconds, nodes / seconds if seconds > 0 else 0))
+   else:
+      with ParallelSearcher(args.workers, args.hash) as searcher:
+         result = searcher.search(gs, args.depth, args.movetime)
+      print(formatInfo(result))
+      print('bestmove %s' % ChessEngine.moveNotation(result.bestMove))
+   return 0
+
+
+if __name__ == "__main__":
+   sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+perft: counts the leaf nodes of the legal move tree to a given depth. it checks getValidMoves/makeMove/undoMove against
+published reference counts and measures their speed, with a stored baseline so slowdowns show up as regressions
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import ChessEngine
+import ChessEPD
+
+# standard perft positions from the chess programming wiki. nodes[i] is the count at depth i + 1,
+# depth is what a default run searches so the whole suite finishes in reasonable time
+REFERENCE_POSITIONS = {
+   'startpos': {
+      'fen': 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+      'nodes': [20, 400, 8902, 197281, 4865609, 119060324],
+      'depth': 5,
+   },
+   'kiwipete': {
+      'fen': 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+      'nodes': [48, 2039, 97862, 4085603, 193690690],
+      'depth': 4,
+   },
+   'position3': {
+      'fen': '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+      'nodes': [14, 191, 2812, 43238, 674624, 11030083],
+      'depth': 5,
+   },
+   'position4': {
+      'fen': 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+      'nodes': [6, 264, 9467, 422333, 15833292],
+      'depth': 4,
+   },
+   'position5': {
+      'fen': 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+      'nodes': [44, 1486, 62379, 2103487, 89941194],
+      'depth': 4,
+   },
+   'position6': {
+      'fen': 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+      'nodes': [46, 2079, 89890, 3894594, 164075551],
+      'depth': 4,
+   },
+}
+
+# deepest D<n> operation read from an epd suite unless --depth asks for less
+MAX_EPD_DEPTH = 6
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'perft_baseline.json')
+
+
+def perft(gs, depth, buffers=None):
+   """
+   buffers holds one reusable move list per remaining depth, so the whole count runs without allocating move lists
+   """
+   if depth == 0:
+      return 1
+   if buffers is None:
+      buffers = [[] for i in range(depth + 1)]
+   moves = buffers[depth]
+   moves.clear()
+   gs.generateMoves(moves)
+   if depth == 1:
+      # bulk count at the frontier, the generated moves are already legal
+      return len(moves)
+   nodes = 0
+   for move in moves:
+      gs.makeMoveCode(move)
+      nodes += perft(gs, depth - 1, buffers)
+      gs.undoMoveCode()
+   return nodes
+
+
+def divide(gs, depth):
+   """
+   perft split by root move, as (move notation, nodes) pairs. comparing this with another engine narrows a wrong count
+   down to the move whose subtree is off
+   """
+   results = []
+   for move in gs.generateMoves([]):
+      gs.makeMoveCode(move)
+      results.append((ChessEngine.moveNotation(move), perft(gs, depth - 1)))
+      gs.undoMoveCode()
+   return results
+
+
+def runPosition(name, depth=None, showDivide=False):
+   """
+   runs one reference position and returns a result dict with nodes, expected nodes, seconds and nodes per second
+   """
+   position = REFERENCE_POSITIONS[name]
+   depth = depth or position['depth']
+   gs = ChessEngine.GameState(position['fen'])
+   start = time.perf_counter()
+   if showDivide:
+      split = divide(gs, depth)
+      nodes = sum(count for notation, count in split)
+   else:
+      nodes = perft(gs, depth)
+   seconds = time.perf_counter() - start
+   if showDivide:
+      for notation, count in split:
+         print('%s: %d' % (notation, count))
+   expected = position['nodes'][depth - 1] if depth <= len(position['nodes']) else None
+   return {'position': name, 'depth': depth, 'nodes': nodes, 'expected': expected,
+           'seconds': seconds, 'nps': int(nodes / seconds) if seconds > 0 else 0}
+
+
+def runEpd(path, depth=None):
+   """
+   checks every position of an epd perft suite, with the expected counts as 'D1 20 ;D2 400' operations. yields one
+   result dict per position and depth, up to depth if given
+   """
+   for index, (gs, operations) in enumerate(ChessEPD.readPositions(path)):
+      for d in range(1, (depth or MAX_EPD_DEPTH) + 1):
+         if 'D%d' % d not in operations:
+            continue
+         start = time.perf_counter()
+         nodes = perft(gs, d)
+         seconds = time.perf_counter() - start
+         yield {'position': '%s:%d' % (os.path.basename(path), index + 1), 'depth': d, 'nodes': nodes,
+                'expected': int(operations['D%d' % d][0]), 'seconds': seconds,
+                'nps': int(nodes / seconds) if seconds > 0 else 0}
+
+
+def loadBaseline(path=BASELINE_FILE):
+   if not os.path.exists(path):
+      return {}
+   with open(path) as f:
+      return json.load(f)
+
+
+def saveBaseline(results, path=BASELINE_FILE):
+   baseline = loadBaseline(path)
+   for result in results:
+      baseline[result['position']] = {'depth': result['depth'], 'nodes': result['nodes'], 'nps': result['nps']}
+   with open(path, 'w') as f:
+      json.dump(baseline, f, indent=2, sort_keys=True)
+      f.write('\n')
+
+
+def compareWithBaseline(result, baseline, tolerance):
+   """
+   returns a warning string if the result is slower than the stored baseline by more than tolerance, otherwise None
+   """
+   stored = baseline.get(result['position'])
+   if stored is None or stored['depth'] != result['depth']:
+      return None
+   if result['nps'] < stored['nps'] * (1 - tolerance):
+      return 'REGRESSION: %d nps against baseline %d' % (result['nps'], stored['nps'])
+   return None
+
+
+def main(argv=None):
+   parser = argparse.ArgumentParser(description='perft correctness and speed suite')
+   parser.add_argument('positions', nargs='*', help='reference positions to run (default: all)')
+   parser.add_argument('--depth', type=int, help='override the default depth of each position')
+   parser.add_argument('--divide', action='store_true', help='print node counts per root move')
+   parser.add_argument('--epd', help='run the perft suite in this epd file instead of the reference positions')
+   parser.add_argument('--save-baseline', action='store_true', help='store the measured speed as the new baseline')
+   parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline (default 0.2)')
+   args = parser.parse_args(argv)
+
+   if args.epd:
+      failed = False
+      for result in runEpd(args.epd, args.depth):
+         status = 'ok' if result['expected'] == result['nodes'] else 'FAIL (expected %d)' % result['expected']
+         failed = failed or status != 'ok'
+         print('%-10s depth %d  nodes %10d  %7.2fs  %8d nps  %s' % (result['position'], result['depth'], result['nodes'],
+                                                                    result['seconds'], result['nps'], status))
+      return 1 if failed else 0
+
+   names = args.positions or list(REFERENCE_POSITIONS)
+   baseline = loadBaseline()
+   results = []
+   failed = False
+   for name in names:
+      result = runPosition(name, args.depth, args.divide)
+      results.append(result)
+      status = 'ok' if result['expected'] in (None, result['nodes']) else 'FAIL (expected %d)' % result['expected']
+      failed = failed or status != 'ok'
+      line = '%-10s depth %d  nodes %10d  %7.2fs  %8d nps  %s' % (name, result['depth'], result['nodes'],
+                                                                  result['seconds'], result['nps'], status)
+      warning = compareWithBaseline(result, baseline, args.tolerance)
+      if warning:
+         line += '  ' + warning
+         failed = True
+      print(line)
+   if args.save_baseline:
+      saveBaseline(results)
+   return 1 if failed else 0
+
+
+if __name__ == "__main__":
+   sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+where engine time goes. a Profiler counts calls on the hot paths of GameState, the attack functions, the
+transposition table and the search while it is enabled: it swaps counting wrappers in for the methods and puts the
+originals back when disabled, so an engine that is not being profiled runs exactly the code it always runs. counts
+export as json or a short per search summary. sampleStacks / profileSearch record a search for flamegraphs
+"""
+
+import argparse
+import collections
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+import ChessEngine
+import ChessSearch
+from ChessTransposition import TranspositionTable
+
+# (owner, attribute, counter name). owners are classes or ChessEngine itself for the attack functions its methods
+# look up as module globals
+INSTRUMENTED = (
+   (ChessEngine.GameState, 'makeMoveCode', 'make'),
+   (ChessEngine.GameState, 'undoMoveCode', 'undo'),
+   (ChessEngine.GameState, 'generateMoves', 'generate.calls'),
+   (ChessEngine.GameState, 'generatePawnMoves', 'generate.pawn'),
+   (ChessEngine.GameState, 'generatePieceMoves', 'generate.knight bishop rook queen'),
+   (ChessEngine.GameState, 'generateKingMoves', 'generate.king'),
+   (ChessEngine.GameState, 'getCastleMoves', 'generate.castle'),
+   (ChessEngine, 'bishopAttacks', 'attacks.bishop'),
+   (ChessEngine, 'rookAttacks', 'attacks.rook'),
+   (ChessEngine.GameState, 'attackersTo', 'attacks.attackersTo'),
+   (ChessEngine.GameState, 'squareUnderAttack', 'attacks.squareUnderAttack'),
+   (ChessEngine.GameState, 'pinsAndChecks', 'pins.pinsAndChecks'),
+   (ChessEngine.GameState, 'checkForPinsAndChecks', 'pins.checkForPinsAndChecks'),
+   (ChessEngine.GameState, 'isInCheck', 'pins.isInCheck'),
+   (ChessSearch, 'evaluate', 'search.evaluate'),
+   (ChessSearch, 'staticExchange', 'search.staticExchange'),
+   (ChessSearch.Searcher, 'quiesce', 'search.quiesce'),
+   (TranspositionTable, 'store', 'tt.store'),
+)
+
+# cutoffs are counted by the index of the move that caused them, later moves share the last slot
+CUTOFF_SLOTS = 16
+
+# seconds between two stack samples, and the thread switch interval used while sampling so the sampler gets its turns
+SAMPLE_INTERVAL = 0.001
+
+
+class Profiler():
+   """
+   counters for one or more searches. use as a context manager or call enable() / disable(). with timers=True
+   every wrapped call is timed as well, which slows the engine down noticeably; the times include nested calls
+   """
+
+   def __init__(self, timers=False):
+      self.timers = timers
+      self.counts = collections.Counter()
+      self.seconds = collections.Counter()
+      self.cutoffs = [0] * CUTOFF_SLOTS
+      self.nodes = 0
+      self.searchSeconds = 0.0
+      self.saved = []
+
+   def __enter__(self):
+      self.enable()
+      return self
+
+   def __exit__(self, *exc):
+      self.disable()
+
+   def enable(self):
+      if self.saved:
+         return
+      for owner, attribute, name in INSTRUMENTED:
+         original = getattr(owner, attribute)
+         self.saved.append((owner, attribute, original))
+         setattr(owner, attribute, self.wrap(original, name))
+      self.saved.append((TranspositionTable, 'probe', TranspositionTable.probe))
+      TranspositionTable.probe = self.wrapProbe(TranspositionTable.probe)
+      self.saved.append((ChessSearch.Searcher, 'search', ChessSearch.Searcher.search))
+      ChessSearch.Searcher.search = self.wrapSearch(ChessSearch.Searcher.search)
+
+   def disable(self):
+      for owner, attribute, original in reversed(self.saved):
+         setattr(owner, attribute, original)
+      self.saved = []
+
+   def reset(self):
+      self.counts.clear()
+      self.seconds.clear()
+      self.cutoffs = [0] * CUTOFF_SLOTS
+      self.nodes = 0
+      self.searchSeconds = 0.0
+
+   def wrap(self, function, name):
+      counts = self.counts
+      if not self.timers:
+         def counted(*args, **kwargs):
+            counts[name] += 1
+            return function(*args, **kwargs)
+         return counted
+      seconds = self.seconds
+      clock = time.perf_counter
+
+      def timed(*args, **kwargs):
+         counts[name] += 1
+         start = clock()
+         try:
+            return function(*args, **kwargs)
+         finally:
+            seconds[name] += clock() - start
+      return timed
+
+   def wrapProbe(self, probe):
+      counts = self.counts
+
+      def countedProbe(table, key):
+         entry = probe(table, key)
+         counts['tt.probe'] += 1
+         if entry is not None:
+            counts['tt.hit'] += 1
+         return entry
+      return countedProbe
+
+   def wrapSearch(self, search):
+      profiler = self
+
+      def profiledSearch(searcher, *args, **kwargs):
+         # the searcher counts cutoffs itself, into our slots, only while it runs under the profiler
+         searcher.cutoffCounts = profiler.cutoffs
+         try:
+            result = search(searcher, *args, **kwargs)
+         finally:
+            searcher.cutoffCounts = None
+         profiler.nodes += result.nodes
+         profiler.searchSeconds += result.seconds
+         return result
+      return profiledSearch
+
+   def report(self):
+      """
+      everything counted so far as a json serialisable dict
+      """
+      report = {'nodes': self.nodes, 'seconds': round(self.searchSeconds, 6), 'counts': dict(sorted(self.counts.items())),
+                'cutoffsByMoveIndex': list(self.cutoffs)}
+      if self.timers:
+         report['callSeconds'] = {name: round(seconds, 6) for name, seconds in sorted(self.seconds.items())}
+      return report
+
+   def writeJson(self, path):
+      with open(path, 'w') as f:
+         json.dump(self.report(), f, indent=2)
+         f.write('\n')
+
+   def summary(self):
+      """
+      a few lines for a person: calls per node, table hit rate and how early cutoffs come
+      """
+      nodes = max(1, self.nodes)
+      lines = ['%d nodes in %.2fs, %d nps' % (self.nodes, self.searchSeconds,
+                                              self.nodes / self.searchSeconds if self.searchSeconds > 0 else 0)]
+      for name, count in sorted(self.counts.items()):
+         line = '  %-34s %10d  %6.2f per node' % (name, count, count / nodes)
+         if name in self.seconds:
+            line += '  %7.3fs' % self.seconds[name]
+         lines.append(line)
+      probes = self.counts['tt.probe']
+      if probes:
+         lines.append('  tt hit rate %.1f%%' % (100.0 * self.counts['tt.hit'] / probes))
+      cutoffs = sum(self.cutoffs)
+      if cutoffs:
+         lines.append('  cutoffs %d, on move 1: %.1f%%, on moves 1-2: %.1f%%' % (
+            cutoffs, 100.0 * self.cutoffs[0] / cutoffs, 100.0 * (self.cutoffs[0] + self.cutoffs[1]) / cutoffs))
+         lines.append('  by move index: %s' % ' '.join(str(count) for count in self.cutoffs))
+      return '\n'.join(lines)
+
+
+def _frameName(frame):
+   code = frame.f_code
+   return '%s:%s' % (os.path.splitext(os.path.basename(code.co_filename))[0], code.co_qualname)
+
+
+def sampleStacks(function, *args, **kwargs):
+   """
+   calls function(*args, **kwargs) while a second thread samples its stack every SAMPLE_INTERVAL seconds. returns
+   (result, Counter of folded stacks), root first and joined by ';' as flamegraph.pl and speedscope read them
+   """
+   target = threading.get_ident()
+   stacks = collections.Counter()
+   done = threading.Event()
+   # the stacks start at function, whatever called sampleStacks is left out
+   root = sampleStacks.__code__
+
+   def sample():
+      while not done.wait(SAMPLE_INTERVAL):
+         frame = sys._current_frames().get(target)
+         names = []
+         while frame is not None and frame.f_code is not root:
+            names.append(_frameName(frame))
+            frame = frame.f_back
+         if names:
+            stacks[';'.join(reversed(names))] += 1
+
+   switchInterval = sys.getswitchinterval()
+   sys.setswitchinterval(SAMPLE_INTERVAL)
+   sampler = threading.Thread(target=sample, daemon=True)
+   sampler.start()
+   try:
+      result = function(*args, **kwargs)
+   finally:
+      done.set()
+      sampler.join()
+      sys.setswitchinterval(switchInterval)
+   return result, stacks
+
+
+def writeFolded(stacks, path):
+   with open(path, 'w') as f:
+      for stack, count in stacks.most_common():
+         f.write('%s %d\n' % (stack, count))
+
+
+def profileSearch(searcher, gs, path, maxDepth=ChessSearch.MAX_PLY, timeLimit=None, nodeLimit=None):
+   """
+   runs a search under cProfile and writes the statistics to path, for pstats, snakeviz or gprof2dot. returns the
+   SearchResult and the pstats.Stats
+   """
+   profile = cProfile.Profile()
+   result = profile.runcall(searcher.search, gs, maxDepth, timeLimit, nodeLimit)
+   profile.dump_stats(path)
+   return result, pstats.Stats(profile)
+
+
+def main(argv=None):
+   parser = argparse.ArgumentParser(description='count, time and profile a search')
+   parser.add_argument('--fen', default=ChessEngine.START_FEN, help='position (default: start position)')
+   parser.add_argument('--depth', type=int, default=5, help='search depth (default 5)')
+   parser.add_argument('--movetime', type=float, help='search time limit in seconds')
+   parser.add_argument('--timers', action='store_true', help='time every counted call too (slow)')
+   parser.add_argument('--json', help='write the counters to this json file')
+   parser.add_argument('--flamegraph', help='sample the search and write folded stacks to this file')
+   parser.add_argument('--cprofile', help='run the search under cProfile and write the stats to this file')
+   args = parser.parse_args(argv)
+
+   gs = ChessEngine.GameState(args.fen)
+   if args.cprofile:
+      result, stats = profileSearch(ChessSearch.Searcher(), gs, args.cprofile, args.depth, args.movetime)
+      stats.sort_stats('tottime').print_stats(15)
+      print(ChessSearch.formatInfo(result))
+      return 0
+   if args.flamegraph:
+      result, stacks = sampleStacks(ChessSearch.Searcher().search, gs, args.depth, args.movetime)
+      writeFolded(stacks, args.flamegraph)
+      print('%d samples written to %s' % (sum(stacks.values()), args.flamegraph))
+      print(ChessSearch.formatInfo(result))
+      return 0
+   with Profiler(args.timers) as profiler:
+      result = ChessSearch.Searcher().search(gs, args.depth, args.movetime)
+   print(ChessSearch.formatInfo(result))
+   print(profiler.summary())
+   if args.json:
+      profiler.writeJson(args.json)
+   return 0
+
+
+if __name__ == "__main__":
+   sys.exit(main())
@@ -0,0 +1,487 @@
+"""
+move selection on top of GameState: iterative deepening principal variation search with a transposition table,
+staged move generation in hash move / mvv-lva / killer / history order and a hard time or node budget. leaves are
+resolved by a quiescence search over captures, pruned by static exchange evaluation and delta pruning. repeated
+positions and the fifty move rule score as draws
+"""
+
+import time
+
+import ChessEngine
+import ChessTablebase
+from ChessEvaluation import evaluate
+from ChessTransposition import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+
+MAX_PLY = 64
+MATE = 30000
+DRAW = 0
+INFINITY = 32000
+
+# centipawn values indexed by piece type (pawn, knight, bishop, rook, queen, king), for ordering captures
+PIECE_VALUES = (100, 320, 330, 500, 900, 0)
+
+HASH_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 28
+KILLER_SCORE = 1 << 27
+# taken off the score of a capture that loses material by static exchange, which sorts it after all other captures
+LOSING_CAPTURE_SCORE = -(1 << 26)
+# quiescence skips a capture when even the victim and this much on top of it would not lift the score to alpha
+DELTA_MARGIN = 200
+
+# how many nodes pass between two looks at the clock
+CHECK_INTERVAL = 1024
+
+
+class SearchResult():
+   """
+   outcome of a search. bestMove and pv hold encoded moves, Move.fromCode turns them into Move objects for the gui
+   """
+
+   def __init__(self, bestMove, score, depth, nodes, seconds, pv):
+      self.bestMove = bestMove
+      self.score = score
+      self.depth = depth
+      self.nodes = nodes
+      self.seconds = seconds
+      self.pv = pv
+
+   def nps(self):
+      return int(self.nodes / self.seconds) if self.seconds > 0 else 0
+
+   def copy(self):
+      """
+      a snapshot, the result an infoCallback gets keeps changing while the search goes on
+      """
+      return SearchResult(self.bestMove, self.score, self.depth, self.nodes, self.seconds, list(self.pv))
+
+
+class Searcher():
+   def __init__(self, tt=None, infoCallback=None, stopSignal=None, book=None, tablebases=None):
+      """
+      stopSignal is an optional buffer shared with other processes, a non-zero first byte stops the search like stop().
+      book is an optional ChessBook.OpeningBook consulted before searching, tablebases an optional
+      ChessTablebase.Tablebases that answers endgame positions below the root without searching them
+      """
+      self.tt = tt if tt is not None else TranspositionTable()
+      self.infoCallback = infoCallback
+      self.stopSignal = stopSignal
+      self.book = book
+      self.tablebases = tablebases
+      self.killers = [[0, 0] for ply in range(MAX_PLY + 1)]
+      self.history = [[0] * 64 for piece in range(12)]
+      # move buffers per ply for captures, quiet moves and single move checks, refilled at every node instead of
+      # building new lists
+      self.moveBuffers = [[[], [], []] for ply in range(MAX_PLY + 1)]
+      self.nodes = 0
+      self.stopped = False
+      self.deadline = None
+      # when the clock behind deadline started, the search start or a ponderhit
+      self.clockStart = None
+      self.nodeLimit = None
+      # a list while ChessProfile watches the search, counting beta cutoffs by the index of the move that caused them
+      self.cutoffCounts = None
+
+   def stop(self):
+      """
+      asks a running search to return as soon as possible, safe to call from another thread
+      """
+      self.stopped = True
+
+   def startClock(self, timeLimit):
+      """
+      sets the deadline timeLimit seconds from now, or none for None. safe to call from another thread, also before
+      the search has started when it was told to keep the clock
+      """
+      now = time.perf_counter()
+      self.clockStart = now
+      self.deadline = now + timeLimit if timeLimit else None
+
+   def search(self, gs, maxDepth=MAX_PLY, timeLimit=None, nodeLimit=None, startDepth=1, keepClock=False):
+      """
+      searches gs to maxDepth or until timeLimit seconds / nodeLimit nodes are spent and returns a SearchResult.
+      the best move of the last completed iteration is kept, so the result is always a legal move if there is one.
+      startDepth skips the iterations below it, for the helpers of a parallel search. with keepClock timeLimit is
+      ignored and the deadline is left to startClock, for pondering, where the clock starts at ponderhit
+      """
+      start = time.perf_counter()
+      if not keepClock:
+         self.startClock(timeLimit)
+      self.nodeLimit = nodeLimit
+      self.nodes = 0
+      self.stopped = False
+      self.tt.newSearch()
+      self.killers = [[0, 0] for ply in range(MAX_PLY + 1)]
+      for pieceHistory in self.history:
+         for sq in range(64):
+            pieceHistory[sq] >>= 2
+      result = SearchResult(None, 0, 0, 0, 0.0, [])
+      rootMoves = gs.generateMoves([])
+      if not rootMoves:
+         return result
+      result.bestMove = rootMoves[0]
+      if self.book is not None:
+         bookMove = self.book.pickMove(gs)
+         if bookMove is not None:
+            # a book hit is played as it is, with depth 0 and no nodes searched
+            result.bestMove = bookMove
+            result.pv = [bookMove]
+            return result
+      for depth in range(min(startDepth, maxDepth, MAX_PLY), min(maxDepth, MAX_PLY) + 1):
+         self.pvTable = [[] for ply in range(MAX_PLY + 1)]
+         score = self.alphaBeta(gs, depth, -INFINITY, INFINITY, 0)
+         if self.stopped and depth > 1:
+            # the previous best move is searched first, so a pv from the interrupted iteration means a fully searched move beat it
+            if self.pvTable[0]:
+               result.bestMove = self.pvTable[0][0]
+            break
+         result.bestMove = self.pvTable[0][0] if self.pvTable[0] else result.bestMove
+         result.score = score
+         result.depth = depth
+         result.pv = list(self.pvTable[0])
+         result.nodes = self.nodes
+         result.seconds = time.perf_counter() - start
+         if self.infoCallback:
+            self.infoCallback(result)
+         if self.stopped or abs(score) >= MATE - MAX_PLY:
+            break
+         # a new iteration costs several times the last one, do not start it without a fair chance to finish. the
+         # deadline is read first, startClock sets it last
+         deadline = self.deadline
+         if deadline and time.perf_counter() - self.clockStart > (deadline - self.clockStart) / 2:
+            break
+      result.nodes = self.nodes
+      result.seconds = time.perf_counter() - start
+      # leave check / mate flags describing the root position rather than the last node searched
+      gs.getValidMoves()
+      return result
+
+   def checkLimits(self):
+      if self.nodeLimit and self.nodes >= self.nodeLimit:
+         self.stopped = True
+      elif self.deadline and time.perf_counter() >= self.deadline:
+         self.stopped = True
+      elif self.stopSignal is not None and self.stopSignal[0]:
+         self.stopped = True
+
+   def orderMoves(self, gs, moves, hashMove, ply):
+      killers = self.killers[ply]
+      squares = gs.squares
+      history = self.history
+      scores = {}
+      for move in moves:
+         if move == hashMove:
+            score = HASH_MOVE_SCORE
+         elif move & (ChessEngine.CAPTURE | ChessEngine.PROMOTION):
+            score = CAPTURE_SCORE + captureScore(squares, move)
+         elif move == killers[0]:
+            score = KILLER_SCORE + 1
+         elif move == killers[1]:
+            score = KILLER_SCORE
+         else:
+            score = history[squares[move & 63]][(move >> 6) & 63]
+         scores[move] = score
+      moves.sort(key=scores.__getitem__, reverse=True)
+
+   def isLegal(self, gs, move, ply):
+      """
+      whether a move from the table or the killers is legal here, by generating only the moves to its end square
+      """
+      moves = self.moveBuffers[ply][2]
+      moves.clear()
+      gs.generateMoves(moves, ChessEngine.ALL_MOVES, 1 << ((move >> 6) & 63))
+      return move in moves
+
+   def pickMoves(self, gs, hashMove, ply, inCheck):
+      """
+      generator over the legal moves of a node in stages: the hash move, captures that do not lose material by their
+      mvv-lva score, the killers, quiet moves by history and last the captures that lose material by static
+      exchange.
+      a stage is only generated once the moves before it failed to cut off. check evasions are few, they are
+      generated and sorted in one go
+      """
+      captures, quiets = self.moveBuffers[ply][:2]
+      if inCheck:
+         captures.clear()
+         gs.generateMoves(captures)
+         self.orderMoves(gs, captures, hashMove, ply)
+         yield from captures
+         return
+      if hashMove and self.isLegal(gs, hashMove, ply):
+         yield hashMove
+
+      squares = gs.squares
+      captures.clear()
+      gs.generateMoves(captures, ChessEngine.CAPTURE_MOVES)
+      scores = {}
+      for move in captures:
+         victim = captureVictim(squares, move)
+         attacker = PIECE_VALUES[squares[move & 63] % 6]
+         score = victim * 16 - attacker // 16
+         # only a dearer piece taking a cheaper one can lose material
+         if attacker > victim and staticExchange(gs, move) < 0:
+            score += LOSING_CAPTURE_SCORE
+         scores[move] = score
+      captures.sort(key=scores.__getitem__, reverse=True)
+      for move in captures:
+         if scores[move] < 0:
+            # the losing captures wait until after the quiet moves
+            break
+         if move != hashMove:
+            yield move
+
+      killers = self.killers[ply]
+      killer0, killer1 = killers
+      for killer in killers:
+         # a killer comes from a sibling position, where its end square may be taken or its piece gone
+         if killer and killer != hashMove and squares[(killer >> 6) & 63] == ChessEngine.EMPTY and \
+               self.isLegal(gs, killer, ply):
+            yield killer
+
+      quiets.clear()
+      gs.generateMoves(quiets, ChessEngine.QUIET_MOVES)
+      history = self.history
+      quiets.sort(key=lambda move: history[squares[move & 63]][(move >> 6) & 63], reverse=True)
+      for move in quiets:
+         if move != hashMove and move != killer0 and move != killer1:
+            yield move
+
+      for move in captures:
+         if scores[move] < 0 and move != hashMove:
+            yield move
+
+   def alphaBeta(self, gs, depth, alpha, beta, ply):
+      self.nodes += 1
+      if self.nodes % CHECK_INTERVAL == 0:
+         self.checkLimits()
+      if self.stopped:
+         return 0
+      self.pvTable[ply] = []
+      if ply > 0:
+         # a position seen before on the game's or the search's own line is scored as the draw it can be made into.
+         # past the fifty move limit only a mate still counts, and only a king in check can be mated
+         if gs.positionCounts[gs.zobristKey] > 1:
+            return DRAW
+         if gs.halfmoveClock >= ChessEngine.FIFTY_MOVE_PLIES and (not gs.isInCheck() or gs.generateMoves([])):
+            return DRAW
+      if ply > 0 and self.tablebases is not None and ChessEngine.popCount(gs.occupied) <= ChessTablebase.MAX_PIECES:
+         value = self.tablebases.probe(gs)
+         if value is not None:
+            return ChessTablebase.valueToScore(value, ply, MATE)
+      if ply >= MAX_PLY:
+         return evaluate(gs)
+      if depth <= 0:
+         return self.quiesce(gs, alpha, beta, ply)
+
+      key = gs.zobristKey
+      hashMove = 0
+      entry = self.tt.probe(key)
+      if entry is not None:
+         hashMove, ttScore, ttDepth, ttFlag = entry
+         if ply > 0 and ttDepth >= depth:
+            ttScore = scoreFromTT(ttScore, ply)
+            if ttFlag == EXACT or (ttFlag == LOWER_BOUND and ttScore >= beta) or (ttFlag == UPPER_BOUND and ttScore <= alpha):
+               return ttScore
+
+      inCheck = gs.isInCheck()
+      if inCheck:
+         depth += 1
+
+      originalAlpha = alpha
+      bestScore = -INFINITY
+      bestMove = 0
+      i = -1
+      for i, move in enumerate(self.pickMoves(gs, hashMove, ply, inCheck)):
+         gs.makeMoveCode(move)
+         if i == 0:
+            score = -self.alphaBeta(gs, depth - 1, -beta, -alpha, ply + 1)
+         else:
+            # null window first, search again with the full window only if the move turns out better than the pv
+            score = -self.alphaBeta(gs, depth - 1, -alpha - 1, -alpha, ply + 1)
+            if alpha < score < beta and not self.stopped:
+               score = -self.alphaBeta(gs, depth - 1, -beta, -alpha, ply + 1)
+         gs.undoMoveCode()
+         if self.stopped:
+            return 0
+         if score > bestScore:
+            bestScore = score
+            bestMove = move
+            if score > alpha:
+               alpha = score
+               self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+               if score >= beta:
+                  if self.cutoffCounts is not None:
+                     self.cutoffCounts[min(i, len(self.cutoffCounts) - 1)] += 1
+                  if not move & (ChessEngine.CAPTURE | ChessEngine.PROMOTION):
+                     killers = self.killers[ply]
+                     if killers[0] != move:
+                        killers[1] = killers[0]
+                        killers[0] = move
+                     self.history[gs.squares[move & 63]][(move >> 6) & 63] += depth * depth
+                  break
+      if i < 0:
+         # no legal move
+         return -MATE + ply if inCheck else DRAW
+
+      if bestScore >= beta:
+         flag = LOWER_BOUND
+      elif bestScore > originalAlpha:
+         flag = EXACT
+      else:
+         flag = UPPER_BOUND
+      self.tt.store(key, bestMove, scoreToTT(bestScore, ply), depth, flag)
+      return bestScore
+
+
+   def quiesce(self, gs, alpha, beta, ply):
+      """
+      captures and promotions only, until the position is quiet, so the evaluation is never taken in the middle of
+      an exchange. the side to move may stand pat on the static evaluation; captures that lose material by static
+      exchange and captures that cannot lift the score to alpha even with DELTA_MARGIN to spare are not searched.
+      in check every evasion is searched instead, as standing pat is no option there
+      """
+      self.nodes += 1
+      if self.nodes % CHECK_INTERVAL == 0:
+         self.checkLimits()
+      if self.stopped:
+         return 0
+      if ply >= MAX_PLY:
+         return evaluate(gs)
+      moves = self.moveBuffers[ply][0]
+      moves.clear()
+      inCheck = gs.isInCheck()
+      if inCheck:
+         gs.generateMoves(moves)
+         if not moves:
+            return -MATE + ply
+         self.orderMoves(gs, moves, 0, ply)
+         bestScore = -INFINITY
+      else:
+         bestScore = evaluate(gs)
+         if bestScore >= beta:
+            return bestScore
+         if bestScore > alpha:
+            alpha = bestScore
+         gs.generateMoves(moves, ChessEngine.CAPTURE_MOVES)
+         squares = gs.squares
+         moves.sort(key=lambda move: captureScore(squares, move), reverse=True)
+      standPat = bestScore
+      squares = gs.squares
+      for move in moves:
+         if not inCheck:
+            victim = captureVictim(squares, move)
+            if not move & ChessEngine.PROMOTION and standPat + victim + DELTA_MARGIN <= alpha:
+               continue
+            if PIECE_VALUES[squares[move & 63] % 6] > victim and staticExchange(gs, move) < 0:
+               continue
+         gs.makeMoveCode(move)
+         score = -self.quiesce(gs, -beta, -alpha, ply + 1)
+         gs.undoMoveCode()
+         if self.stopped:
+            return 0
+         if score > bestScore:
+            bestScore = score
+            if score > alpha:
+               alpha = score
+               if score >= beta:
+                  break
+      return bestScore
+
+
+def staticExchange(gs, move):
+   """
+   material the side to move wins or loses with a capture on (move's end square) once every piece that attacks it
+   has taken in turn, cheapest first, and either side stops as soon as going on would lose. works on the bitboards
+   alone: attackersTo is asked again with each piece that took off the board, which brings in the sliders behind
+   it. pins are not looked at
+   """
+   start = move & 63
+   end = (move >> 6) & 63
+   squares = gs.squares
+   bitboards = gs.bitboards
+   occupied = gs.occupied ^ (1 << start)
+   onSquare = PIECE_VALUES[squares[start] % 6]
+   if move & ChessEngine.FLAGS_MASK == ChessEngine.EN_PASSANT:
+      gain = PIECE_VALUES[ChessEngine.PAWN]
+      occupied ^= 1 << (end + 8 if gs.whiteToMove else end - 8)
+   else:
+      gain = PIECE_VALUES[squares[end] % 6] if squares[end] != ChessEngine.EMPTY else 0
+   if move & ChessEngine.PROMOTION:
+      onSquare = PIECE_VALUES[ChessEngine.KNIGHT + ((move >> 12) & 3)]
+      gain += onSquare - PIECE_VALUES[ChessEngine.PAWN]
+   gains = [gain]
+   color = ChessEngine.BLACK if gs.whiteToMove else ChessEngine.WHITE
+   while True:
+      attackers = gs.attackersTo(end, color, occupied) & occupied
+      if not attackers:
+         break
+      base = 6 * color
+      for pieceType in range(6):
+         pieces = attackers & bitboards[base + pieceType]
+         if pieces:
+            break
+      lsb = pieces & -pieces
+      occupied ^= lsb
+      color = 1 - color
+      # a king may only take last, when nothing can take it back
+      if pieceType == ChessEngine.KING and gs.attackersTo(end, color, occupied) & occupied:
+         break
+      gains.append(onSquare - gains[-1])
+      onSquare = PIECE_VALUES[pieceType]
+   # each side takes only when it gains by it, counted back from the last capture
+   for i in range(len(gains) - 1, 0, -1):
+      gains[i - 1] = -max(-gains[i - 1], gains[i])
+   return gains[0]
+
+
+def captureVictim(squares, move):
+   """
+   what a capture wins. an empty end square (en passant, quiet promotion) reads as a pawn, a promotion adds the new
+   piece
+   """
+   victim = PIECE_VALUES[squares[(move >> 6) & 63] % 6]
+   if move & ChessEngine.PROMOTION:
+      victim += PIECE_VALUES[ChessEngine.KNIGHT + ((move >> 12) & 3)]
+   return victim
+
+
+def captureScore(squares, move):
+   """
+   mvv-lva: the victim's value times 16 less a sixteenth of the attacker's
+   """
+   return captureVictim(squares, move) * 16 - PIECE_VALUES[squares[move & 63] % 6] // 16
+
+
+def scoreToTT(score, ply):
+   # mate scores are stored relative to the node, not to the root, so they stay right when reached by another path
+   if score >= MATE - MAX_PLY:
+      return score + ply
+   if score <= -MATE + MAX_PLY:
+      return score - ply
+   return score
+
+
+def scoreFromTT(score, ply):
+   if score >= MATE - MAX_PLY:
+      return score - ply
+   if score <= -MATE + MAX_PLY:
+      return score + ply
+   return score
+
+
+def formatScore(score):
+   """
+   a score as uci writes it: 'cp 35', or 'mate 3' / 'mate -2' counted in moves
+   """
+   if abs(score) >= MATE - MAX_PLY:
+      mateIn = (MATE - abs(score) + 1) // 2
+      return 'mate %d' % (mateIn if score > 0 else -mateIn)
+   return 'cp %d' % score
+
+
+def formatInfo(result):
+   """
+   one uci style info line for a finished iteration
+   """
+   return 'info depth %d score %s nodes %d nps %d time %d pv %s' % (
+      result.depth, formatScore(result.score), result.nodes, result.nps(), int(result.seconds * 1000),
+      ' '.join(ChessEngine.moveNotation(move) for move in result.pv))
@@ -0,0 +1,109 @@
+"""
+headless self-play: plays batches of engine games without pygame and streams one json line (or pgn game) per
+finished game, for generating training and regression data in volume
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+import ChessEngine
+import ChessPGN
+from ChessBook import OpeningBook
+from ChessSearch import Searcher
+from ChessTransposition import TranspositionTable
+
+
+def playGame(searcher, rng, depth, nodeLimit, timeLimit, randomPlies, maxPlies, book=None):
+   """
+   plays one game from the start position and returns a result dict. the first randomPlies moves are picked at random
+   so games in a batch do not all repeat the same line, after that book moves are played while the book has any
+   """
+   gs = ChessEngine.GameState()
+   searcher.tt.clear()
+   moves = []
+   sans = []
+   result, termination = '1/2-1/2', 'max plies'
+   while len(moves) < maxPlies:
+      legal = gs.generateMoves([])
+      if not legal:
+         if gs.inCheck:
+            result, termination = ('0-1' if gs.whiteToMove else '1-0'), 'checkmate'
+         else:
+            termination = 'stalemate'
+         break
+      if gs.isThreefoldRepetition():
+         termination = 'threefold repetition'
+         break
+      if gs.isFiftyMoveDraw():
+         termination = 'fifty move rule'
+         break
+      # the book is asked here rather than by the searcher so its choices come from the game's own seed
+      bookMove = book.pickMove(gs, rng) if book is not None and len(moves) >= randomPlies else None
+      if len(moves) < randomPlies:
+         move = rng.choice(legal)
+      elif bookMove is not None:
+         move = bookMove
+      else:
+         move = searcher.search(gs, depth, timeLimit, nodeLimit).bestMove
+      sans.append(ChessPGN.moveToSan(gs, move, legal))
+      gs.makeMoveCode(move)
+      moves.append(ChessEngine.moveNotation(move))
+   return {'result': result, 'termination': termination, 'plies': len(moves), 'moves': ' '.join(moves),
+           'san': ' '.join(sans)}
+
+
+def playGames(games, depth=3, nodeLimit=None, timeLimit=None, randomPlies=4, maxPlies=200, seed=0, hashMB=4, book=None):
+   """
+   generator over finished games, so results can be written out while the batch is still running. game i uses the
+   random seed seed + i, which makes every game reproducible on its own. book is an optional OpeningBook
+   """
+   searcher = Searcher(TranspositionTable(hashMB))
+   for i in range(games):
+      start = time.perf_counter()
+      game = playGame(searcher, random.Random(seed + i), depth, nodeLimit, timeLimit, randomPlies, maxPlies, book)
+      game['game'] = i
+      game['seed'] = seed + i
+      game['seconds'] = round(time.perf_counter() - start, 3)
+      yield game
+
+
+def main(argv=None):
+   parser = argparse.ArgumentParser(description='headless engine self-play, one json line per game')
+   parser.add_argument('--games', type=int, default=10, help='number of games to play (default 10)')
+   parser.add_argument('--depth', type=int, default=3, help='search depth per move (default 3)')
+   parser.add_argument('--nodes', type=int, help='node limit per move')
+   parser.add_argument('--movetime', type=float, help='time limit per move in seconds')
+   parser.add_argument('--random-plies', type=int, default=4, help='random opening moves per game (default 4)')
+   parser.add_argument('--max-plies', type=int, default=200, help='plies before a game is called a draw (default 200)')
+   parser.add_argument('--seed', type=int, default=0, help='seed of the first game (default 0)')
+   parser.add_argument('--hash', type=int, default=4, help='transposition table size in MB (default 4)')
+   parser.add_argument('--book', help='polyglot opening book to play from before searching')
+   parser.add_argument('--output', help='file to write to (default stdout)')
+   parser.add_argument('--pgn', action='store_true', help='write the games as pgn instead of json lines')
+   args = parser.parse_args(argv)
+
+   book = OpeningBook(args.book) if args.book else None
+   out = open(args.output, 'w') if args.output else sys.stdout
+   try:
+      for game in playGames(args.games, args.depth, args.nodes, args.movetime, args.random_plies, args.max_plies,
+                            args.seed, args.hash, book):
+         if args.pgn:
+            headers = {'Event': 'self-play', 'Round': str(game['game'] + 1), 'White': 'ChessEngine',
+                       'Black': 'ChessEngine', 'Termination': game['termination']}
+            ChessPGN.writeGames(out, [ChessPGN.PgnGame(headers, game['san'].split(), game['result'])])
+         else:
+            out.write(json.dumps(game) + '\n')
+         out.flush()
+   finally:
+      if out is not sys.stdout:
+         out.close()
+      if book is not None:
+         book.close()
+   return 0
+
+
+if __name__ == "__main__":
+   sys.exit(main())
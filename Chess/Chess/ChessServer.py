@@ -0,0 +1,321 @@
+"""
+local analysis service. an http server takes json requests with a fen, optional moves and search limits and hands
+them to a pool of engine processes. identical requests that arrive while one is being searched wait for the same
+search, and finished results are kept in a size bounded lru cache. GET /stats reports queue depth, cache use and
+request latency percentiles. it binds to localhost and needs nothing but the standard library; the loadtest mode
+is a client for it
+"""
+
+import argparse
+import collections
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ChessEngine
+from ChessSearch import Searcher, MAX_PLY, formatScore
+from ChessTransposition import TranspositionTable
+
+DEFAULT_PORT = 8765
+# used when a request sets no limit at all
+DEFAULT_DEPTH = 5
+DEFAULT_CACHE_SIZE = 10000
+# latency percentiles are taken over this many of the latest requests
+LATENCY_WINDOW = 1000
+MAX_BODY_BYTES = 65536
+
+# per process searcher of a pool worker, made once by _initWorker
+_worker = {}
+
+
+def _initWorker(hashMB):
+   _worker['searcher'] = Searcher(TranspositionTable(hashMB))
+
+
+def _analyseTask(snapshot, depth, movetime, nodes):
+   result = _worker['searcher'].search(ChessEngine.GameState.fromSnapshot(snapshot), depth, movetime, nodes)
+   notation = ChessEngine.moveNotation
+   return {'bestmove': notation(result.bestMove) if result.bestMove is not None else None,
+           'score': formatScore(result.score), 'depth': result.depth, 'nodes': result.nodes,
+           'seconds': round(result.seconds, 4), 'pv': [notation(move) for move in result.pv]}
+
+
+def percentile(values, fraction):
+   """
+   nearest rank percentile of a sorted list, None for an empty one
+   """
+   if not values:
+      return None
+   return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def latencySummary(seconds):
+   """
+   p50 / p90 / p99 / max in milliseconds of a list of latencies in seconds
+   """
+   ordered = sorted(seconds)
+   summary = {}
+   for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)):
+      value = percentile(ordered, fraction)
+      summary[name] = round(value * 1000, 2) if value is not None else None
+   return summary
+
+
+class AnalysisService():
+   """
+   the pool, the cache and the counters, without the http around them. analyse() blocks until the result is there
+   and is safe to call from many threads at once. call close() or use it as a context manager
+   """
+
+   def __init__(self, workers=None, hashMB=16, cacheSize=DEFAULT_CACHE_SIZE):
+      self.workers = workers or os.cpu_count() or 1
+      self.cacheSize = cacheSize
+      self.executor = ProcessPoolExecutor(self.workers, initializer=_initWorker, initargs=(hashMB,))
+      # reentrant, a search that is already done when its callback is added runs finish() inside analyse()'s lock
+      self.lock = threading.RLock()
+      self.cache = collections.OrderedDict()
+      # key -> future of the search that will answer it
+      self.inFlight = {}
+      self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+      self.counts = collections.Counter()
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exc):
+      self.close()
+
+   def requestKey(self, request):
+      """
+      the cache key of a request dict and the arguments of its search task. raises ValueError for anything malformed.
+      the key is the position with its repetition history and the limits, so requests only share a result when they
+      ask the same question
+      """
+      fen = request.get('fen', ChessEngine.START_FEN)
+      if not isinstance(fen, str):
+         raise ValueError('fen must be a string')
+      gs = ChessEngine.GameState(fen)
+      moves = []
+      notations = request.get('moves', [])
+      if not isinstance(notations, list):
+         raise ValueError('moves must be a list of moves like "e2e4"')
+      for notation in notations:
+         move = next((move for move in gs.generateMoves([]) if ChessEngine.moveNotation(move) == notation), None)
+         if move is None:
+            raise ValueError('illegal move %r' % (notation,))
+         gs.makeMoveCode(move)
+         moves.append(move)
+      depth = self.limit(request, 'depth', int, 1, MAX_PLY)
+      movetime = self.limit(request, 'movetime', float, 0.001, 3600.0)
+      nodes = self.limit(request, 'nodes', int, 1, 1 << 40)
+      if depth is None and movetime is None and nodes is None:
+         depth = DEFAULT_DEPTH
+      depth = depth or MAX_PLY
+      # only the moves since the last irreversible one can repeat, so two move lists reaching the same position share
+      # a key. the fullmove number never changes a search and the halfmove clock only does when the search can reach
+      # the fifty move limit, which is never more than MAX_PLY plies away
+      clock = gs.halfmoveClock if gs.halfmoveClock >= ChessEngine.FIFTY_MOVE_PLIES - MAX_PLY else None
+      key = (bytes(gs.squares), gs.whiteToMove, gs.castleRights, gs.enPassantSquare, tuple(gs.historyMoves()), clock,
+             depth, movetime, nodes)
+      return key, (gs.toBytes(history=True), depth, movetime, nodes)
+
+   def limit(self, request, name, kind, lowest, highest):
+      value = request.get(name)
+      if value is None:
+         return None
+      if isinstance(value, bool) or not isinstance(value, (int, float)) or not lowest <= value <= highest:
+         raise ValueError('%s must be a number from %s to %s' % (name, lowest, highest))
+      return kind(value)
+
+   def analyse(self, request):
+      """
+      the result dict for a request dict, from the cache, from a search already running or from a new one
+      """
+      start = time.perf_counter()
+      key, task = self.requestKey(request)
+      with self.lock:
+         self.counts['requests'] += 1
+         result = self.cache.get(key)
+         if result is not None:
+            self.cache.move_to_end(key)
+            self.counts['cacheHits'] += 1
+            future = None
+         else:
+            future = self.inFlight.get(key)
+            if future is not None:
+               self.counts['deduplicated'] += 1
+            else:
+               self.counts['searches'] += 1
+               future = self.executor.submit(_analyseTask, *task)
+               self.inFlight[key] = future
+               future.add_done_callback(lambda done: self.finish(key, done))
+      if future is not None:
+         result = future.result()
+      with self.lock:
+         self.latencies.append(time.perf_counter() - start)
+      return result
+
+   def finish(self, key, future):
+      with self.lock:
+         del self.inFlight[key]
+         if future.cancelled() or future.exception() is not None:
+            return
+         self.cache[key] = future.result()
+         while len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+
+   def stats(self):
+      with self.lock:
+         inFlight = len(self.inFlight)
+         stats = dict(self.counts)
+         stats.update({'workers': self.workers, 'inFlight': inFlight, 'queueDepth': max(0, inFlight - self.workers),
+                       'cacheEntries': len(self.cache), 'cacheSize': self.cacheSize,
+                       'latencyMs': latencySummary(self.latencies)})
+      return stats
+
+   def close(self):
+      self.executor.shutdown(cancel_futures=True)
+
+
+class AnalysisHandler(BaseHTTPRequestHandler):
+   """
+   POST /analyse with a json object {"fen", "moves", "depth", "movetime", "nodes"}, all optional, movetime in
+   seconds. GET /stats. answers are json, errors come as {"error": ...} with a 4xx / 5xx status
+   """
+
+   def do_GET(self):
+      if self.path == '/stats':
+         self.reply(200, self.server.service.stats())
+      else:
+         self.reply(404, {'error': 'not found'})
+
+   def do_POST(self):
+      if self.path != '/analyse':
+         self.reply(404, {'error': 'not found'})
+         return
+      length = int(self.headers.get('Content-Length') or 0)
+      if length > MAX_BODY_BYTES:
+         self.reply(413, {'error': 'request too large'})
+         return
+      try:
+         request = json.loads(self.rfile.read(length) or b'{}')
+         if not isinstance(request, dict):
+            raise ValueError('request must be a json object')
+         result = self.server.service.analyse(request)
+      except ValueError as e:
+         self.reply(400, {'error': str(e)})
+         return
+      except Exception as e:
+         self.reply(500, {'error': '%s: %s' % (type(e).__name__, e)})
+         return
+      self.reply(200, result)
+
+   def reply(self, status, body):
+      data = json.dumps(body).encode()
+      self.send_response(status)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(data)))
+      self.end_headers()
+      self.wfile.write(data)
+
+   def log_message(self, format, *args):
+      if self.server.verbose:
+         super().log_message(format, *args)
+
+
+def makeServer(service, host='127.0.0.1', port=DEFAULT_PORT, verbose=False):
+   """
+   a ThreadingHTTPServer answering for service, one thread per connection. port 0 picks a free port, see
+   server.server_address
+   """
+   server = ThreadingHTTPServer((host, port), AnalysisHandler)
+   server.daemon_threads = True
+   server.service = service
+   server.verbose = verbose
+   return server
+
+
+def post(url, request, timeout=600):
+   data = json.dumps(request).encode()
+   req = urllib.request.Request(url + '/analyse', data, {'Content-Type': 'application/json'})
+   with urllib.request.urlopen(req, timeout=timeout) as response:
+      return json.loads(response.read())
+
+
+def loadTest(url, requests, total=100, concurrency=8):
+   """
+   sends total requests drawn at random from the request dicts in requests, concurrency at a time, and returns the
+   client side numbers: throughput, errors and latency percentiles
+   """
+   rng = random.Random(0)
+   picks = [rng.choice(requests) for i in range(total)]
+
+   def timedPost(request):
+      start = time.perf_counter()
+      try:
+         post(url, request)
+         failed = False
+      except (urllib.error.URLError, OSError):
+         failed = True
+      return time.perf_counter() - start, failed
+
+   start = time.perf_counter()
+   with ThreadPoolExecutor(concurrency) as executor:
+      outcomes = list(executor.map(timedPost, picks))
+   seconds = time.perf_counter() - start
+   return {'requests': total, 'errors': sum(failed for latency, failed in outcomes), 'seconds': round(seconds, 3),
+           'perSecond': round(total / seconds, 1) if seconds > 0 else None,
+           'latencyMs': latencySummary([latency for latency, failed in outcomes])}
+
+
+def main(argv=None):
+   parser = argparse.ArgumentParser(description='local http analysis service, and a load test client for it')
+   parser.add_argument('mode', choices=('serve', 'loadtest'))
+   parser.add_argument('--host', default='127.0.0.1', help='address to serve on (default 127.0.0.1)')
+   parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port (default %d)' % DEFAULT_PORT)
+   parser.add_argument('--workers', type=int, help='engine processes (default: one per cpu)')
+   parser.add_argument('--hash', type=int, default=16, help='transposition table per worker in MB (default 16)')
+   parser.add_argument('--cache', type=int, default=DEFAULT_CACHE_SIZE,
+                       help='results kept in the lru cache (default %d)' % DEFAULT_CACHE_SIZE)
+   parser.add_argument('--verbose', action='store_true', help='log every request')
+   parser.add_argument('--epd', help='loadtest: positions to ask for (default: a few built in ones)')
+   parser.add_argument('--requests', type=int, default=100, help='loadtest: requests to send (default 100)')
+   parser.add_argument('--concurrency', type=int, default=8, help='loadtest: requests at a time (default 8)')
+   parser.add_argument('--depth', type=int, default=4, help='loadtest: search depth per request (default 4)')
+   args = parser.parse_args(argv)
+
+   if args.mode == 'serve':
+      with AnalysisService(args.workers, args.hash, args.cache) as service:
+         server = makeServer(service, args.host, args.port, args.verbose)
+         print('serving on http://%s:%d' % server.server_address[:2])
+         try:
+            server.serve_forever()
+         except KeyboardInterrupt:
+            pass
+         finally:
+            server.server_close()
+      return 0
+
+   from ChessEPD import readEpd
+   fens = [fen for fen, operations in readEpd(args.epd)] if args.epd else [
+      ChessEngine.START_FEN,
+      'r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP1B1PPP/R2QKB1R w KQ - 0 8',
+      'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+      '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1']
+   url = 'http://%s:%d' % (args.host, args.port)
+   print(json.dumps(loadTest(url, [{'fen': fen, 'depth': args.depth} for fen in fens], args.requests,
+                             args.concurrency), indent=2))
+   with urllib.request.urlopen(url + '/stats') as response:
+      print(json.dumps({'server': json.loads(response.read())}, indent=2))
+   return 0
+
+
+if __name__ == "__main__":
+   sys.exit(main())
@@ -0,0 +1,393 @@
+"""
+distance to mate endgame tablebases for positions with up to four pieces, kings included. tables are built by
+retrograde analysis on top of GameState's move rules and kept as flat arrays of int16 in files that are memory
+mapped when probed, so a lookup is one index computation and one read. generation leaves en passant out, so tables
+with pawns on both sides, where a double push can allow it, are not built
+"""
+
+import argparse
+import itertools
+import mmap
+import os
+import sys
+import time
+from array import array
+
+import ChessEngine
+from ChessAttacks import KNIGHT_ATTACKS, KING_ATTACKS, rookAttacks, bishopAttacks
+
+# a stored value of 0 is a draw (or an impossible position). otherwise abs(value) - 1 is the number of plies to mate,
+# positive when the side to move mates, negative when it gets mated
+PIECE_LETTERS = 'PNBRQK'
+# stronger pieces first, the order pieces are listed in a table name
+NAME_ORDER = 'KQRBNP'
+LETTER_VALUES = {'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'P': 1}
+MAX_PIECES = 4
+FILE_SUFFIX = '.tb'
+# exitMax marker for a position that has a drawing or winning capture or promotion, so it can never be lost
+CANNOT_LOSE = 255
+
+
+def parseName(name):
+   """
+   'KRKP' -> ('R', 'P'): the white and the black pieces besides the kings
+   """
+   if len(name) < 2 or name[0] != 'K' or 'K' not in name[1:]:
+      raise ValueError('table name must look like KQK or KRKP: %r' % name)
+   split = name.index('K', 1)
+   white, black = name[1:split], name[split + 1:]
+   if any(letter not in LETTER_VALUES for letter in white + black):
+      raise ValueError('bad piece in table name %r' % name)
+   return white, black
+
+
+def canonicalName(white, black):
+   """
+   (name, flipped) of the table holding a material balance. tables are stored with the stronger side as white, flipped
+   tells that colours have to be swapped and the board mirrored to look the position up
+   """
+   white = ''.join(sorted(white, key=NAME_ORDER.index))
+   black = ''.join(sorted(black, key=NAME_ORDER.index))
+   whiteKey = (sum(LETTER_VALUES[letter] for letter in white), [-NAME_ORDER.index(letter) for letter in white])
+   blackKey = (sum(LETTER_VALUES[letter] for letter in black), [-NAME_ORDER.index(letter) for letter in black])
+   if blackKey > whiteKey:
+      return 'K' + black + 'K' + white, True
+   return 'K' + white + 'K' + black, False
+
+
+def enPassantPossible(name):
+   """
+   whether both sides have pawns, so that a double push in the table can allow an en passant capture
+   """
+   white, black = parseName(name)
+   return 'P' in white and 'P' in black
+
+
+def tablePieces(name):
+   """
+   piece indices in table order: white king, white pieces, black king, black pieces
+   """
+   white, black = parseName(name)
+   return ([ChessEngine.KING] + [PIECE_LETTERS.index(letter) for letter in white] +
+           [6 + ChessEngine.KING] + [6 + PIECE_LETTERS.index(letter) for letter in black])
+
+
+def dependencies(name):
+   """
+   the smaller or converted tables a capture or promotion in this table leads to, in canonical names. tables with
+   pawns on both sides are left out, they cannot be generated
+   """
+   white, black = parseName(name)
+   found = set()
+   for side, other, flip in ((white, black, False), (black, white, True)):
+      for i in range(len(side)):
+         for results in (side[:i] + side[i + 1:],) + tuple(side[:i] + promoted + side[i + 1:] for promoted in 'QRBN'
+                                                            if side[i] == 'P'):
+            # the piece is captured, or it is a pawn that promotes
+            if results == side:
+               continue
+            found.add(canonicalName(*((other, results) if flip else (results, other)))[0])
+      for j, letter in enumerate(side):
+         if letter != 'P':
+            continue
+         # a pawn promoting with a capture
+         for k in range(len(other)):
+            for promoted in 'QRBN':
+               results = side[:j] + promoted + side[j + 1:]
+               remaining = other[:k] + other[k + 1:]
+               found.add(canonicalName(*((remaining, results) if flip else (results, remaining)))[0])
+   found.discard('KK')
+   return sorted(dependency for dependency in found if not enPassantPossible(dependency))
+
+
+class Tablebases():
+   """
+   the tables found in one directory, memory mapped on first use
+   """
+
+   def __init__(self, directory):
+      self.directory = directory
+      self.tables = {}
+
+   def close(self):
+      for table in self.tables.values():
+         if table is not None:
+            table[0].release()
+            table[1].close()
+      self.tables = {}
+
+   def path(self, name):
+      return os.path.join(self.directory, name + FILE_SUFFIX)
+
+   def table(self, name):
+      if name not in self.tables:
+         path = self.path(name)
+         if os.path.exists(path):
+            with open(path, 'rb') as f:
+               mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.tables[name] = (memoryview(mapped).cast('h'), mapped)
+         else:
+            self.tables[name] = None
+      table = self.tables[name]
+      return table[0] if table is not None else None
+
+   def probe(self, gs):
+      """
+      the stored value of the position, or None when there is no table for it. positions with castling rights or a
+      possible en passant capture are not in the tables
+      """
+      if gs.castleRights or gs.enPassantKey(ChessEngine.WHITE if gs.whiteToMove else ChessEngine.BLACK):
+         return None
+      if ChessEngine.popCount(gs.occupied) > MAX_PIECES:
+         return None
+      white, black = [], []
+      whiteKing = blackKing = 0
+      for sq in range(64):
+         piece = gs.squares[sq]
+         if piece == ChessEngine.KING:
+            whiteKing = sq
+         elif piece == 6 + ChessEngine.KING:
+            blackKing = sq
+         elif piece < 6:
+            white.append((PIECE_LETTERS[piece], sq))
+         elif piece < 12:
+            black.append((PIECE_LETTERS[piece - 6], sq))
+      if not white and not black:
+         return 0
+      name, flipped = canonicalName(''.join(letter for letter, sq in white), ''.join(letter for letter, sq in black))
+      table = self.table(name)
+      if table is None:
+         return None
+      white.sort(key=lambda entry: NAME_ORDER.index(entry[0]))
+      black.sort(key=lambda entry: NAME_ORDER.index(entry[0]))
+      side = 0 if gs.whiteToMove else 1
+      if flipped:
+         # black is the stronger side: swap the colours and mirror the board top to bottom
+         squares = [blackKing ^ 56] + [sq ^ 56 for letter, sq in black] + [whiteKing ^ 56] + [sq ^ 56 for letter, sq in white]
+         side ^= 1
+      else:
+         squares = [whiteKing] + [sq for letter, sq in white] + [blackKing] + [sq for letter, sq in black]
+      index = side
+      for sq in squares:
+         index = index * 64 + sq
+      return table[index]
+
+
+def valueToScore(value, ply, mate):
+   """
+   a stored value as a search score at ply, on the same scale as mate scores found by searching
+   """
+   if value > 0:
+      return mate - ply - (value - 1)
+   if value < 0:
+      return -mate + ply + (-value - 1)
+   return 0
+
+
+def _unmoveTargets(piece, sq, occupied):
+   """
+   empty squares the piece can have come from to reach sq without capturing
+   """
+   kind = piece % 6
+   if kind == ChessEngine.KNIGHT:
+      targets = KNIGHT_ATTACKS[sq]
+   elif kind == ChessEngine.KING:
+      targets = KING_ATTACKS[sq]
+   elif kind == ChessEngine.BISHOP:
+      targets = bishopAttacks(sq, occupied)
+   elif kind == ChessEngine.ROOK:
+      targets = rookAttacks(sq, occupied)
+   elif kind == ChessEngine.QUEEN:
+      targets = rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+   else:
+      # pawns move back one row, or two from their double push row, and never stand on the last rows
+      step = 8 if piece == ChessEngine.PAWN else -8
+      targets = 0
+      back = sq + step
+      if 8 <= back < 56 and not occupied & (1 << back):
+         targets = 1 << back
+         double = back + step
+         if (sq >> 3) == (4 if piece == ChessEngine.PAWN else 3) and not occupied & (1 << double):
+            targets |= 1 << double
+   return targets & ~occupied
+
+
+def generate(name, tablebases, log=None):
+   """
+   builds one table and writes it to the tablebase directory, building the tables it depends on first.
+   every position is first set up once with GameState: it gets its count of moves that stay inside the table, and
+   its captures and promotions are looked up in the smaller tables. mates are then spread backwards ply by ply with
+   un-moves, a position is won as soon as one move reaches a lost one and lost once every move reaches a won one
+   """
+   name = canonicalName(*parseName(name))[0]
+   if enPassantPossible(name):
+      # positions are stored without an en passant square, the values after a double push would ignore the capture
+      raise ValueError('en passant is not handled, no tables with pawns on both sides: %r' % name)
+   for dependency in dependencies(name):
+      if tablebases.table(dependency) is None:
+         generate(dependency, tablebases, log)
+   start = time.perf_counter()
+   pieces = tablePieces(name)
+   n = len(pieces)
+   if n > MAX_PIECES:
+      raise ValueError('tables go up to %d pieces: %r' % (MAX_PIECES, name))
+   sideSize = 64 ** n
+   size = 2 * sideSize
+   multipliers = [64 ** (n - 1 - i) for i in range(n)]
+   values = array('h', bytes(2 * size))
+   remaining = bytearray(size)
+   exitMax = bytearray(size)
+   legal = bytearray(size)
+   pending = {}
+
+   kingSlots = (pieces.index(ChessEngine.KING), pieces.index(6 + ChessEngine.KING))
+   gs = ChessEngine.GameState()
+   gs.castleRights = 0
+   gs.enPassantSquare = -1
+   moves = []
+   for combo, squares in enumerate(itertools.product(range(64), repeat=n)):
+      if len(set(squares)) != n:
+         continue
+      board = [ChessEngine.EMPTY] * 64
+      for piece, sq in zip(pieces, squares):
+         if piece % 6 == ChessEngine.PAWN and (sq < 8 or sq >= 56):
+            break
+         board[sq] = piece
+      else:
+         gs.squares = board
+         gs.initBitboards()
+         for side in (0, 1):
+            index = side * sideSize + combo
+            gs.whiteToMove = side == 0
+            # the side that just moved must not be in check
+            if gs.attackersTo(squares[kingSlots[1 - side]], side, gs.occupied):
+               continue
+            legal[index] = 1
+            moves.clear()
+            gs.generateMoves(moves)
+            if not moves:
+               if gs.inCheck:
+                  pending.setdefault(0, array('l')).append(index)
+               continue
+            count = 0
+            worst = 0
+            for move in moves:
+               if not move & (ChessEngine.CAPTURE | ChessEngine.PROMOTION):
+                  count += 1
+                  continue
+               gs.makeMoveCode(move)
+               value = tablebases.probe(gs)
+               gs.undoMoveCode()
+               if value is None:
+                  raise RuntimeError('missing table for a capture or promotion from %s' % name)
+               if value < 0:
+                  # the opponent gets mated after this move
+                  pending.setdefault(-value, array('l')).append(index)
+                  worst = CANNOT_LOSE
+               elif value == 0:
+                  worst = CANNOT_LOSE
+               elif worst != CANNOT_LOSE:
+                  worst = max(worst, value)
+            remaining[index] = count
+            exitMax[index] = worst
+            if count == 0 and worst != CANNOT_LOSE:
+               pending.setdefault(worst, array('l')).append(index)
+
+   level = 0
+   while pending:
+      batch = pending.pop(level, None)
+      if batch:
+         decided = array('l')
+         for index in batch:
+            if not values[index]:
+               values[index] = level + 1 if level & 1 else -(level + 1)
+               decided.append(index)
+         for index in decided:
+            _propagate(index, level, pieces, sideSize, multipliers, legal, values, remaining, exitMax, pending)
+      level += 1
+
+   os.makedirs(tablebases.directory, exist_ok=True)
+   path = tablebases.path(name)
+   with open(path + '.tmp', 'wb') as f:
+      values.tofile(f)
+   os.replace(path + '.tmp', path)
+   tablebases.tables.pop(name, None)
+   if log:
+      longest = max(abs(value) for value in values) - 1
+      log('%s: %d positions, %s, %.1fs' % (name, sum(legal), 'longest mate %d plies' % longest if longest >= 0 else 'no mates',
+                                           time.perf_counter() - start))
+   return path
+
+
+def _propagate(index, level, pieces, sideSize, multipliers, legal, values, remaining, exitMax, pending):
+   """
+   hands a position just decided at level to every position one un-move before it
+   """
+   side, combo = divmod(index, sideSize)
+   squares = []
+   for multiplier in multipliers:
+      sq, combo = divmod(combo, multiplier)
+      squares.append(sq)
+   occupied = 0
+   for sq in squares:
+      occupied |= 1 << sq
+   # predecessors have the other side to move, the one whose piece moved
+   base = index + (sideSize if side == 0 else -sideSize)
+   mover = 1 - side
+   lost = not level & 1
+   for i, piece in enumerate(pieces):
+      if piece // 6 != mover:
+         continue
+      sq = squares[i]
+      targets = _unmoveTargets(piece, sq, occupied)
+      while targets:
+         lsb = targets & -targets
+         targets ^= lsb
+         previous = base + ((lsb.bit_length() - 1) - sq) * multipliers[i]
+         if not legal[previous] or values[previous]:
+            continue
+         if lost:
+            pending.setdefault(level + 1, array('l')).append(previous)
+         else:
+            remaining[previous] -= 1
+            if not remaining[previous] and exitMax[previous] != CANNOT_LOSE:
+               # every move now reaches a won position, the longest of them decides how long the loss takes
+               pending.setdefault(max(level, exitMax[previous] - 1) + 1, array('l')).append(previous)
+
+
+def main(argv=None):
+   parser = argparse.ArgumentParser(description='endgame tablebase generation and probing')
+   parser.add_argument('mode', choices=('generate', 'probe'))
+   parser.add_argument('items', nargs='+', help='table names like KQK KRKP to generate, or fen strings to probe')
+   parser.add_argument('--dir', default='tablebases', help='tablebase directory (default ./tablebases)')
+   args = parser.parse_args(argv)
+
+   tablebases = Tablebases(args.dir)
+   # a bad item is reported on one line and the others still run, the exit code tells that one failed
+   failed = False
+   if args.mode == 'generate':
+      for name in args.items:
+         try:
+            generate(name, tablebases, print)
+         except ValueError as e:
+            print('%s: %s' % (name, e))
+            failed = True
+      return 1 if failed else 0
+   for fen in args.items:
+      try:
+         value = tablebases.probe(ChessEngine.GameState(fen))
+      except ValueError as e:
+         print('%s: %s' % (fen, e))
+         failed = True
+         continue
+      if value is None:
+         print('%s: no table' % fen)
+      elif value == 0:
+         print('%s: draw' % fen)
+      else:
+         print('%s: %s in %d plies' % (fen, 'mates' if value > 0 else 'mated', abs(value) - 1))
+   return 1 if failed else 0
+
+
+if __name__ == "__main__":
+   sys.exit(main())
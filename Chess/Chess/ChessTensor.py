@@ -0,0 +1,162 @@
+"""
+positions as numpy arrays, for data pipelines. a batch is first packed into one uint64 bitboard per plane, straight
+from GameState.bitboards, and then unpacked into (N, PLANES, 8, 8) uint8 planes by numpy in one go, so the python
+work per position is copying 12 ints and the state. evaluateBatch scores a whole batch of planes with the tables of
+ChessEvaluation in a few array operations. needs numpy, which the rest of the engine does not
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+import ChessEngine
+from ChessEPD import readEpd
+from ChessEvaluation import PST, PHASE, MAX_PHASE, unpack
+
+# planes 0 - 11 are the pieces in GameState.bitboards order, color * 6 + type. square index is row * 8 + col with
+# a8 = 0, so plane[row][col] reads like GameState.board
+PIECE_PLANES = 12
+# all ones when white is to move
+SIDE_PLANE = 12
+# one plane per castling right, all ones while it is held: white kingside, white queenside, black kingside, black
+# queenside
+CASTLE_PLANES = (13, 14, 15, 16)
+CASTLE_RIGHTS = (ChessEngine.WHITE_KINGSIDE, ChessEngine.WHITE_QUEENSIDE, ChessEngine.BLACK_KINGSIDE,
+                 ChessEngine.BLACK_QUEENSIDE)
+# the en passant target square, if any
+EN_PASSANT_PLANE = 17
+PLANES = 18
+
+# rows per evaluateBatch step, bounds the temporary arrays whatever the size of the batch
+EVAL_CHUNK = 4096
+
+
+def packBatch(positions, out=None):
+   """
+   (N, PLANES) uint64, every plane as a bitboard. positions is any iterable of GameStates; each one is read before the
+   next is asked for, so a generator may hand out the same GameState loaded with one position after another. out is
+   an optional preallocated array to fill
+   """
+   bitboards = []
+   states = []
+   for gs in positions:
+      bitboards += gs.bitboards
+      states.append((gs.whiteToMove, gs.castleRights, gs.enPassantSquare))
+   n = len(states)
+   if out is None:
+      out = np.empty((n, PLANES), np.uint64)
+   elif out.shape != (n, PLANES) or out.dtype != np.uint64:
+      raise ValueError('out needs shape %r and dtype uint64, not %r %s' % ((n, PLANES), out.shape, out.dtype))
+   if n == 0:
+      return out
+   out[:, :PIECE_PLANES] = np.array(bitboards, np.uint64).reshape(n, PIECE_PLANES)
+   state = np.array(states, np.int64).reshape(n, 3)
+   full = np.uint64(ChessEngine.FULL)
+   out[:, SIDE_PLANE] = np.where(state[:, 0] != 0, full, np.uint64(0))
+   for plane, rights in zip(CASTLE_PLANES, CASTLE_RIGHTS):
+      out[:, plane] = np.where(state[:, 1] & rights, full, np.uint64(0))
+   enPassant = state[:, 2]
+   out[:, EN_PASSANT_PLANE] = np.where(enPassant >= 0, np.uint64(1) << np.maximum(enPassant, 0).astype(np.uint64),
+                                       np.uint64(0))
+   return out
+
+
+def unpackPlanes(packed, out=None):
+   """
+   (N, PLANES, 8, 8) uint8 of 0 and 1 from the bitboards of packBatch. out is an optional preallocated array to fill
+   """
+   n = packed.shape[0]
+   if out is not None and (out.shape != (n, PLANES, 8, 8) or out.dtype != np.uint8):
+      raise ValueError('out needs shape %r and dtype uint8, not %r %s' % ((n, PLANES, 8, 8), out.shape, out.dtype))
+   # little endian bytes put bit 0, square a8, first once the bits of every byte are unpacked low bit first. the
+   # bytes are unpacked as one flat run, numpy is many times slower along an axis
+   raw = np.ascontiguousarray(packed, '<u8').reshape(-1).view(np.uint8)
+   planes = np.unpackbits(raw, bitorder='little').reshape(n, PLANES, 8, 8)
+   if out is None:
+      return planes
+   out[:] = planes
+   return out
+
+
+def encodeBatch(positions, out=None):
+   """
+   (N, PLANES, 8, 8) uint8 planes of the GameStates in positions, see packBatch
+   """
+   return unpackPlanes(packBatch(positions), out)
+
+
+def _evaluationWeights():
+   # one row per piece plane square: middlegame value, endgame value and phase weight
+   weights = np.zeros((PIECE_PLANES * 64, 3), np.float32)
+   for piece in range(PIECE_PLANES):
+      for sq in range(64):
+         mg, eg = unpack(PST[piece][sq])
+         weights[piece * 64 + sq] = (mg, eg, PHASE[piece])
+   return weights
+
+# float32 sums are exact here, every term is a small integer and no sum gets near 2 ** 24
+EVAL_WEIGHTS = _evaluationWeights()
+
+
+def evaluateBatch(planes, out=None):
+   """
+   ChessEvaluation.evaluate for every position of a (N, PLANES, 8, 8) batch, in centipawns for the side to move, as
+   an int32 array. the piece planes go through one matrix product per chunk of rows, then the scores are tapered and
+   turned around for black like evaluate does, with the same results
+   """
+   n = planes.shape[0]
+   if out is None:
+      out = np.empty(n, np.int32)
+   for start in range(0, n, EVAL_CHUNK):
+      chunk = planes[start:start + EVAL_CHUNK]
+      terms = chunk[:, :PIECE_PLANES].reshape(len(chunk), PIECE_PLANES * 64).astype(np.float32) @ EVAL_WEIGHTS
+      terms = terms.astype(np.int64)
+      phase = np.minimum(terms[:, 2], MAX_PHASE)
+      score = (terms[:, 0] * phase + terms[:, 1] * (MAX_PHASE - phase)) // MAX_PHASE
+      out[start:start + len(chunk)] = np.where(chunk[:, SIDE_PLANE, 0, 0] != 0, score, -score)
+   return out
+
+
+def _loadEach(fens):
+   # one GameState reloaded for every position, packBatch reads each before the next is loaded
+   gs = ChessEngine.GameState()
+   for fen in fens:
+      gs.loadFen(fen)
+      yield gs
+
+
+def main(argv=None):
+   parser = argparse.ArgumentParser(description='encode the positions of an epd or fen file as numpy arrays')
+   parser.add_argument('path', help='epd file, one position per line, .gz is read compressed')
+   parser.add_argument('--output', required=True, help='.npy file for the planes')
+   parser.add_argument('--packed', action='store_true', help='save (N, PLANES) uint64 bitboards instead of planes')
+   parser.add_argument('--scores', help='.npy file for the static evaluation of every position')
+   parser.add_argument('--batch', type=int, default=EVAL_CHUNK, help='positions per batch (default %d)' % EVAL_CHUNK)
+   args = parser.parse_args(argv)
+
+   fens = [fen for fen, operations in readEpd(args.path)]
+   n = len(fens)
+   # the output is filled batch by batch through a memory map, the planes of the whole file never sit in memory
+   if args.packed:
+      output = np.lib.format.open_memmap(args.output, 'w+', np.uint64, (n, PLANES))
+   else:
+      output = np.lib.format.open_memmap(args.output, 'w+', np.uint8, (n, PLANES, 8, 8))
+   scores = np.empty(n, np.int32) if args.scores else None
+   for start in range(0, n, args.batch):
+      batch = fens[start:start + args.batch]
+      end = start + len(batch)
+      packed = packBatch(_loadEach(batch), output[start:end] if args.packed else None)
+      if not args.packed:
+         unpackPlanes(packed, output[start:end])
+      if scores is not None:
+         evaluateBatch(output[start:end] if not args.packed else unpackPlanes(packed), scores[start:end])
+   output.flush()
+   if scores is not None:
+      np.save(args.scores, scores)
+   print('%d positions written to %s' % (n, args.output))
+   return 0
+
+
+if __name__ == "__main__":
+   sys.exit(main())
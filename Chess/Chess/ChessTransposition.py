@@ -0,0 +1,127 @@
+"""
+fixed size transposition table keyed by GameState.zobristKey, so search and analysis can reuse results for positions reached by different move orders
+"""
+
+from array import array
+
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# every entry is two unsigned 64 bit words: the full zobrist key and a packed data word
+ENTRY_BYTES = 16
+BUCKET_SIZE = 2
+MOVE_BITS = 20
+SCORE_SHIFT = MOVE_BITS
+SCORE_OFFSET = 1 << 15
+DEPTH_SHIFT = SCORE_SHIFT + 16
+FLAG_SHIFT = DEPTH_SHIFT + 8
+GENERATION_SHIFT = FLAG_SHIFT + 2
+GENERATION_MASK = 0x3F
+
+
+class TranspositionTable():
+   """
+   entries live in two flat arrays so the memory budget is exact. each bucket has two slots: the first keeps the deepest
+   result of the current search, the second is always replaced, so fresh shallow results do not push out expensive deep ones.
+   keys are stored xor their data word: when processes share the table, an entry torn by two writers fails the key
+   check instead of handing out the data of another position
+   """
+
+   def __init__(self, sizeMB=16, buffer=None):
+      if buffer is None:
+         self.resize(sizeMB)
+      else:
+         self.attach(buffer, sizeMB)
+
+   @staticmethod
+   def bytesFor(sizeMB):
+      """
+      storage a table of sizeMB really uses, the largest power of two number of buckets that fits
+      """
+      buckets = 1
+      while buckets * 2 * BUCKET_SIZE * ENTRY_BYTES <= sizeMB * 1024 * 1024:
+         buckets *= 2
+      return buckets * BUCKET_SIZE * ENTRY_BYTES
+
+   def resize(self, sizeMB):
+      entries = self.bytesFor(sizeMB) // ENTRY_BYTES
+      self.sizeMB = sizeMB
+      self.bucketMask = entries // BUCKET_SIZE - 1
+      self.keys = array('Q', bytes(entries * 8))
+      self.data = array('Q', bytes(entries * 8))
+      self.generation = 0
+
+   def attach(self, buffer, sizeMB):
+      """
+      keeps the table in buffer, bytesFor(sizeMB) bytes of e.g. multiprocessing shared memory, instead of private
+      arrays, so several processes search with one table. the buffer is used as it is, not cleared
+      """
+      words = memoryview(buffer)[:self.bytesFor(sizeMB)].cast('Q')
+      entries = len(words) // 2
+      self.sizeMB = sizeMB
+      self.bucketMask = entries // BUCKET_SIZE - 1
+      self.keys = words[:entries]
+      self.data = words[entries:]
+      self.generation = 0
+
+   def clear(self):
+      empty = array('Q', bytes(len(self.keys) * 8))
+      self.keys[:] = empty
+      self.data[:] = empty
+      self.generation = 0
+
+   def newSearch(self):
+      """
+      ages the table so entries from earlier searches lose their protection in the depth-preferred slot
+      """
+      self.generation = (self.generation + 1) & GENERATION_MASK
+
+   def __len__(self):
+      return len(self.keys)
+
+   def probe(self, key):
+      """
+      returns (move, score, depth, flag) stored for key, or None
+      """
+      slot = (key & self.bucketMask) * BUCKET_SIZE
+      for i in (slot, slot + 1):
+         data = self.data[i]
+         if self.keys[i] ^ data == key:
+            if data:
+               return (data & ((1 << MOVE_BITS) - 1),
+                       ((data >> SCORE_SHIFT) & 0xFFFF) - SCORE_OFFSET,
+                       (data >> DEPTH_SHIFT) & 0xFF,
+                       (data >> FLAG_SHIFT) & 0x3)
+      return None
+
+   def store(self, key, move, score, depth, flag):
+      slot = (key & self.bucketMask) * BUCKET_SIZE
+      keys = self.keys
+      data = self.data
+      if keys[slot + 1] ^ data[slot + 1] == key and data[slot + 1]:
+         slot += 1
+      elif keys[slot] ^ data[slot] != key:
+         old = data[slot]
+         if old and ((old >> GENERATION_SHIFT) & GENERATION_MASK) == self.generation and \
+               ((old >> DEPTH_SHIFT) & 0xFF) > depth:
+            slot += 1
+      if not move and keys[slot] ^ data[slot] == key:
+         # keep the best move of a previous visit when this one did not produce any
+         move = data[slot] & ((1 << MOVE_BITS) - 1)
+      word = move | (score + SCORE_OFFSET) << SCORE_SHIFT | max(0, min(depth, 0xFF)) << DEPTH_SHIFT | \
+             flag << FLAG_SHIFT | self.generation << GENERATION_SHIFT
+      keys[slot] = key ^ word
+      data[slot] = word
+
+   def hashfull(self):
+      """
+      permille of sampled slots used by the current search, as reported by uci engines
+      """
+      sample = min(1000, len(self.data))
+      used = 0
+      for i in range(sample):
+         data = self.data[i]
+         if data and ((data >> GENERATION_SHIFT) & GENERATION_MASK) == self.generation:
+            used += 1
+      return used * 1000 // sample
@@ -0,0 +1,226 @@
+"""
+uci front end, so the engine runs under tournament managers and chess guis. stdin is read by an asyncio task while the
+search runs on a worker thread, so stop, ponderhit and isready are handled while the engine is thinking
+"""
+
+import asyncio
+import functools
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ChessEngine
+from ChessSearch import Searcher, MAX_PLY, formatInfo
+from ChessTransposition import TranspositionTable
+
+ENGINE_NAME = 'ChessEngine'
+ENGINE_AUTHOR = 'anubis66ma'
+DEFAULT_HASH = 16
+MAX_HASH = 4096
+# safety margin per move for uci and process overhead, in seconds
+MOVE_OVERHEAD = 0.03
+# moves left to plan for when the gui does not send movestogo
+DEFAULT_MOVES_TO_GO = 30
+
+
+def allocateTime(args, whiteToMove):
+   """
+   seconds to spend on a move from the go arguments, None for no time limit
+   """
+   if 'movetime' in args:
+      return max(0.001, args['movetime'] / 1000 - MOVE_OVERHEAD)
+   remaining = args.get('wtime' if whiteToMove else 'btime')
+   if remaining is None:
+      return None
+   increment = args.get('winc' if whiteToMove else 'binc', 0)
+   movesToGo = args.get('movestogo', DEFAULT_MOVES_TO_GO)
+   budget = remaining / max(1, movesToGo) + increment * 0.75
+   # never plan to use more than half the clock on one move
+   return max(0.001, min(budget, remaining / 2) / 1000 - MOVE_OVERHEAD)
+
+
+class UciEngine():
+   def __init__(self, output=None):
+      self.output = output or self.write
+      self.tt = TranspositionTable(DEFAULT_HASH)
+      # stop() on its own could be cleared by a search thread that has not started yet, the signal byte is only
+      # cleared by go
+      self.stopSignal = bytearray(1)
+      self.searcher = Searcher(self.tt, self.sendInfo, self.stopSignal)
+      self.gs = ChessEngine.GameState()
+      self.executor = ThreadPoolExecutor(1)
+      self.search = None
+      # set when a bestmove may be sent: always for timed searches, only after stop or ponderhit for infinite ones
+      self.release = None
+      self.stopTime = None
+      self.timeLimit = None
+      self.running = True
+
+   def write(self, line):
+      sys.stdout.write(line + '\n')
+      sys.stdout.flush()
+
+   def sendInfo(self, result):
+      # called on the search thread after every finished iteration
+      self.output('%s hashfull %d' % (formatInfo(result), self.tt.hashfull()))
+
+   async def run(self, stream=None):
+      """
+      reads commands until quit or end of input
+      """
+      loop = asyncio.get_running_loop()
+      readline = (stream or sys.stdin).readline
+      while self.running:
+         line = await loop.run_in_executor(None, readline)
+         if not line:
+            break
+         await self.handle(line.strip())
+      await self.stopSearch()
+      self.executor.shutdown()
+
+   async def handle(self, line):
+      tokens = line.split()
+      if not tokens:
+         return
+      command, args = tokens[0], tokens[1:]
+      if command == 'uci':
+         self.output('id name %s' % ENGINE_NAME)
+         self.output('id author %s' % ENGINE_AUTHOR)
+         self.output('option name Hash type spin default %d min 1 max %d' % (DEFAULT_HASH, MAX_HASH))
+         self.output('option name Ponder type check default false')
+         self.output('uciok')
+      elif command == 'isready':
+         self.output('readyok')
+      elif command == 'setoption':
+         await self.stopSearch()
+         self.setOption(args)
+      elif command == 'ucinewgame':
+         await self.stopSearch()
+         self.tt.clear()
+         self.gs = ChessEngine.GameState()
+      elif command == 'position':
+         await self.stopSearch()
+         self.setPosition(args)
+      elif command == 'go':
+         await self.stopSearch()
+         self.go(args)
+      elif command == 'stop':
+         self.stopTime = time.perf_counter()
+         self.stopSignal[0] = 1
+         self.searcher.stop()
+         if self.release is not None:
+            self.release.set()
+      elif command == 'ponderhit':
+         self.ponderhit()
+      elif command == 'quit':
+         self.stopSignal[0] = 1
+         self.searcher.stop()
+         self.running = False
+
+   def setOption(self, args):
+      if 'name' not in args:
+         return
+      valueAt = args.index('value') if 'value' in args else len(args)
+      name = ' '.join(args[args.index('name') + 1:valueAt]).lower()
+      value = ' '.join(args[valueAt + 1:])
+      if name == 'hash' and value.isdigit():
+         self.tt.resize(max(1, min(int(value), MAX_HASH)))
+
+   def setPosition(self, args):
+      if args and args[0] == 'startpos':
+         fen, rest = ChessEngine.START_FEN, args[1:]
+      elif args and args[0] == 'fen':
+         end = args.index('moves') if 'moves' in args else len(args)
+         fen, rest = ' '.join(args[1:end]), args[end:]
+      else:
+         return
+      try:
+         gs = ChessEngine.GameState(fen)
+      except ValueError as e:
+         self.output('info string %s' % e)
+         return
+      for notation in rest[1:] if rest and rest[0] == 'moves' else ():
+         move = next((move for move in gs.generateMoves([]) if ChessEngine.moveNotation(move) == notation), None)
+         if move is None:
+            self.output('info string illegal move %s' % notation)
+            break
+         gs.makeMoveCode(move)
+      self.gs = gs
+
+   def go(self, args):
+      options = {}
+      i = 0
+      while i < len(args):
+         key = args[i]
+         if key in ('infinite', 'ponder'):
+            options[key] = True
+         elif key in ('wtime', 'btime', 'winc', 'binc', 'movestogo', 'movetime', 'depth', 'nodes') and i + 1 < len(args):
+            try:
+               options[key] = int(args[i + 1])
+            except ValueError:
+               pass
+            i += 1
+         i += 1
+      self.timeLimit = allocateTime(options, self.gs.whiteToMove)
+      waitForRelease = 'infinite' in options or 'ponder' in options
+      self.release = asyncio.Event()
+      if not waitForRelease:
+         self.release.set()
+      self.stopTime = None
+      self.stopSignal[0] = 0
+      # the clock is started here, before the search thread runs, so a ponderhit that comes first is not undone when
+      # the search starts. a ponder or infinite search gets its time limit at ponderhit
+      self.searcher.startClock(None if waitForRelease else self.timeLimit)
+      loop = asyncio.get_running_loop()
+      work = loop.run_in_executor(self.executor, functools.partial(
+         self.searcher.search, self.gs, options.get('depth', MAX_PLY), nodeLimit=options.get('nodes'), keepClock=True))
+      self.search = asyncio.ensure_future(self.finishSearch(work))
+
+   def ponderhit(self):
+      """
+      the expected move was played, the ponder search goes on as a normal timed search
+      """
+      if self.search is None or self.release.is_set():
+         return
+      self.release.set()
+      self.searcher.startClock(self.timeLimit)
+
+   async def finishSearch(self, work):
+      try:
+         result = await work
+      except Exception as e:
+         # a failed search still owes the gui its bestmove, and the engine goes on reading commands
+         self.output('info string search failed: %s: %s' % (type(e).__name__, e))
+         result = None
+      # uci does not allow a bestmove during pondering or infinite search before the gui asks for it
+      await self.release.wait()
+      if result is None or result.bestMove is None:
+         line = 'bestmove 0000'
+      else:
+         line = 'bestmove %s' % ChessEngine.moveNotation(result.bestMove)
+         if len(result.pv) > 1:
+            line += ' ponder %s' % ChessEngine.moveNotation(result.pv[1])
+      if self.stopTime is not None:
+         self.output('info string stop latency %.1f ms' % ((time.perf_counter() - self.stopTime) * 1000))
+      self.output(line)
+
+   async def stopSearch(self):
+      """
+      ends a running search and waits until its bestmove went out
+      """
+      if self.search is not None:
+         if not self.search.done():
+            self.stopSignal[0] = 1
+            self.searcher.stop()
+            self.release.set()
+         await self.search
+         self.search = None
+
+
+def main():
+   asyncio.run(UciEngine().run())
+   return 0
+
+
+if __name__ == "__main__":
+   sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+the engine in a process of its own, so a gui never blocks on a search. requests go in through one queue and info /
+results come back through another, tagged with the id of the request they answer, so the gui can cancel, take back
+or reset at any time and simply ignore whatever is still on its way from an older request
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+
+import ChessEngine
+from ChessParallel import ParallelSearcher
+from ChessSearch import Searcher, MAX_PLY
+from ChessTransposition import TranspositionTable
+
+
+def _run(requests, results, workers, hashMB):
+   """
+   body of the engine process. the main thread only reads requests, searches run on a second thread, so a stop is
+   acted on while the search is going
+   """
+   # stop() on its own could be cleared by a search that has not started yet, like in ChessUCI
+   stopSignal = bytearray(1)
+   if workers > 1:
+      searcher = ParallelSearcher(workers, hashMB)
+   else:
+      searcher = Searcher(TranspositionTable(hashMB), stopSignal=stopSignal)
+   thread = None
+   while True:
+      request = requests.get()
+      if request[0] in ('search', 'quit') and thread is not None:
+         stopSignal[0] = 1
+         searcher.stop()
+         thread.join()
+         thread = None
+      if request[0] == 'search':
+         requestId, snapshot, maxDepth, timeLimit, nodeLimit = request[1:]
+         # cleared here, before the thread starts, so a stop that comes in right after is never lost
+         stopSignal[0] = 0
+         if workers > 1:
+            searcher.reset()
+         thread = threading.Thread(target=_search, args=(searcher, results, requestId, snapshot, maxDepth, timeLimit,
+                                                         nodeLimit))
+         thread.start()
+      elif request[0] == 'stop':
+         stopSignal[0] = 1
+         searcher.stop()
+      elif request[0] == 'quit':
+         if workers > 1:
+            searcher.close()
+         return
+
+
+def _search(searcher, results, requestId, snapshot, maxDepth, timeLimit, nodeLimit):
+   searcher.infoCallback = lambda result: results.put(('info', requestId, result.copy()))
+   # every request ends with a done or an error, whatever goes wrong, or the gui would wait for it forever
+   try:
+      result = searcher.search(ChessEngine.GameState.fromSnapshot(snapshot), maxDepth, timeLimit, nodeLimit)
+   except Exception as e:
+      results.put(('error', requestId, '%s: %s' % (type(e).__name__, e)))
+      return
+   results.put(('done', requestId, result))
+
+
+class EngineWorker():
+   """
+   handle on the engine process. start() sends a position off, poll() never blocks and returns the messages of the
+   current request only: ('info', SearchResult) after every finished iteration and ('done', SearchResult) at the end,
+   or ('error', message) in its place when the search failed. with more than one worker the process searches with ParallelSearcher on that many cores
+   """
+
+   def __init__(self, workers=None, hashMB=16):
+      self.workers = workers or os.cpu_count() or 1
+      self.requests = multiprocessing.Queue()
+      self.results = multiprocessing.Queue()
+      # not a daemon, a ParallelSearcher needs to start processes of its own
+      self.process = multiprocessing.Process(target=_run, args=(self.requests, self.results, self.workers, hashMB))
+      self.process.start()
+      self.requestId = 0
+      self.current = None
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exc):
+      self.close()
+
+   @property
+   def busy(self):
+      return self.current is not None
+
+   def start(self, gs, maxDepth=MAX_PLY, timeLimit=None, nodeLimit=None):
+      """
+      searches the position of gs, replacing any search still running. returns the id of the request
+      """
+      self.requestId += 1
+      self.current = self.requestId
+      # the moves since the last capture or pawn move go along, so the engine sees the repetitions
+      self.requests.put(('search', self.requestId, gs.toBytes(history=True), maxDepth, timeLimit, nodeLimit))
+      return self.requestId
+
+   def cancel(self):
+      """
+      stops the current search; its result, and anything it still sends, is dropped
+      """
+      if self.current is not None:
+         self.requests.put(('stop',))
+         self.current = None
+
+   def poll(self):
+      messages = []
+      while True:
+         try:
+            kind, requestId, result = self.results.get_nowait()
+         except queue.Empty:
+            return messages
+         if requestId != self.current:
+            continue
+         if kind in ('done', 'error'):
+            self.current = None
+         messages.append((kind, result))
+
+   def close(self):
+      self.cancel()
+      self.requests.put(('quit',))
+      self.process.join(5)
+      if self.process.is_alive():
+         self.process.terminate()
+         self.process.join()